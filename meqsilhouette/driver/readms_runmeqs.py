@@ -80,9 +80,13 @@ def readms_runmeqs(jsonfile, msname):
     os.system('cp -r %s %s'%(parameters['bandpass_table'], input_copy_path))
     os.system('cp -r %s %s'%(msname, input_copy_path))
 
-    ### INI: Regularize MS and move the output to v.OUTDIR
+    ### INI: All stages index the rows by their own time and baseline, so MSs with missing rows can be used directly.
+    ### Regularizing (padding missing baselines with flagged rows) is optional, since it makes a deep copy of the MS.
     inms_abspath = os.path.join(input_copy_path, os.path.basename(msname))
-    outms_abspath = regularize_ms(inms_abspath)
+    if parameters.get('regularize_input_ms', 0):
+        outms_abspath = regularize_ms(inms_abspath)
+    else:
+        outms_abspath = inms_abspath
     os.system('mv %s %s'%(outms_abspath, v.OUTDIR))
     v.MS = os.path.join(v.OUTDIR, os.path.basename(outms_abspath))  # name of output Measurement Set
 
@@ -101,7 +105,7 @@ def readms_runmeqs(jsonfile, msname):
         abort('Requested data column %s not present in %s'%(ms_dict['datacolumn'], v.MS))
     tab.close()
 
-    # Replace appropriate values from the regularized MS in the dicts
+    # Replace appropriate values from the (regularized) MS in the dicts
     ms_dict['antenna_table'] = os.path.join(v.MS, 'ANTENNA')
 
     info('Loaded input configuration file: \n%s'%config_abspath)
@@ -179,7 +183,18 @@ def readms_runmeqs(jsonfile, msname):
                                parameters["predict_seed"], parameters["atm_seed"], aperture_eff,\
                                parameters["elevation_limit"], parameters['trop_enabled'], parameters['trop_wetonly'], pwv, gpress, gtemp, \
                                coherence_time, parameters['trop_fixdelay_max_picosec'], parameters['uvjones_g_on'], parameters['uvjones_d_on'], parameters['parang_corrected'],\
-                               gR_mean, gR_std, gL_mean, gL_std, dR_mean, dR_std, dL_mean, dL_std, feed_angle, parameters['add_thermal_noise'])
+                               gR_mean, gR_std, gL_mean, gL_std, dR_mean, dR_std, dL_mean, dL_std, feed_angle, parameters['add_thermal_noise'],\
+                               fuse_corruptions=parameters.get('fuse_corruptions', 0), streaming=parameters.get('streaming', 0),\
+                               row_chunksize=parameters.get('row_chunksize', 100000), noise_workers=parameters.get('noise_workers', 1),\
+                               cache_dir=parameters.get('cache_dir', None), aatm_workers=parameters.get('aatm_workers', 0),\
+                               aatm_cache_size=parameters.get('aatm_cache_size', 100), atm_grid=parameters.get('atm_grid', None),\
+                               turbulence_method=parameters.get('turbulence_method', 'fft'),\
+                               turbulence_cache_size=parameters.get('turbulence_cache_size', 1000),\
+                               turbulence_realisations=parameters.get('turbulence_realisations', 1),\
+                               turbulence_cluster_radius=parameters.get('turbulence_cluster_radius', 0),\
+                               wind_speed=parameters.get('wind_speed', 10.),\
+                               wind_direction=parameters.get('wind_direction', 0.),\
+                               geometry_cache_size=parameters.get('geometry_cache_size', 1000))
     sim_coord.interferometric_sim()
 
     #################### START COURRPTING VISIBILITIES ####################
@@ -188,10 +203,18 @@ def readms_runmeqs(jsonfile, msname):
     
     if parameters['pointing_enabled']:
         info('Pointing errors are enabled, applying antenna-based amplitudes errors')
-        info('Current pointing error model is a constant offset that changes on a user-specified time interval, current setting = %.1f minutes'%\
-             parameters['pointing_time_per_mispoint'])
-        
-        sim_coord.pointing_constant_offset(pointing_rms,parameters['pointing_time_per_mispoint'],PB_FWHM230)
+        if parameters.get('pointing_model', 'constant') == 'continuous':
+            info('Current pointing error model is a constant offset per scan plus a drift with rms %.1f arcsec and timescale %.1f seconds'%\
+                 (parameters.get('pointing_drift_rms', 0.), parameters.get('pointing_drift_timescale', 5.)))
+            sim_coord.pointing_continuous_offset(pointing_rms,PB_FWHM230,parameters.get('pointing_drift_rms', 0.),\
+                                                 parameters.get('pointing_drift_timescale', 5.))
+        elif parameters.get('pointing_model', 'constant') == 'constant':
+            info('Current pointing error model is a constant offset that changes on a user-specified time interval, current setting = %.1f minutes'%\
+                 parameters['pointing_time_per_mispoint'])
+            sim_coord.pointing_constant_offset(pointing_rms,parameters['pointing_time_per_mispoint'],PB_FWHM230)
+        else:
+            abort("pointing_model must be 'constant' or 'continuous', not '%s'"%parameters['pointing_model'])
+
         sim_coord.apply_pointing_amp_error()
 
         if parameters['pointing_makeplots']:
@@ -200,7 +223,6 @@ def readms_runmeqs(jsonfile, msname):
         
     ### TROPOSPHERE COMPONENTS ###
     combined_phase_errors = 0 #init for trop combo choice
-    additive_noises       = None
     if parameters['trop_enabled']:
         info('Tropospheric module is enabled, applying corruptions...')
         if parameters['trop_wetonly']:
@@ -214,7 +236,7 @@ def readms_runmeqs(jsonfile, msname):
 
         if parameters['trop_noise']:
             info('TROPOSPHERE NOISE: adding sky noise from non-zero PWV...')
-            additive_noises = sim_coord.trop_add_sky_noise()
+            sim_coord.trop_add_sky_noise()
 
         if parameters['trop_mean_delay']:
             info('TROPOSPHERE DELAY: computing mean delay (time-variability from elevation changes)...')
@@ -242,7 +264,7 @@ def readms_runmeqs(jsonfile, msname):
             info('Generated troposphere plots')
 
     ### POPULATE MS WITH SIGMA AND WEIGHT ESTIMATORS ###
-    # sim_coord.add_weights(additive_noises)
+    # sim_coord.add_weights()
 
     ### PARALLACTIC ANGLE AND POLARIZATION LEAKAGE ###
     if parameters['uvjones_d_on']:
@@ -273,6 +295,12 @@ def readms_runmeqs(jsonfile, msname):
         sim_coord.add_receiver_noise()
         info('Thermal noise added.')
 
+    ### Write additional realisations of the turbulence (if requested) to separate columns ###
+    sim_coord.write_turbulence_ensemble()
+
+    ### Apply deferred corruptions (if fused) and write the data to the MS once ###
+    sim_coord.flush_jones_chain()
+
     ### IMAGING, PLOTTING, DATA EXPORT ###        
     if parameters['make_image']:
         info('Imaging the %s column'%ms_dict['datacolumn'])
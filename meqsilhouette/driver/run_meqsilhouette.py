@@ -196,7 +196,18 @@ def run_meqsilhouette(config=None):
                                parameters["predict_seed"], parameters["atm_seed"], aperture_eff,\
                                parameters["elevation_limit"], parameters['trop_enabled'], parameters['trop_wetonly'], pwv, gpress, gtemp, \
                                coherence_time, parameters['trop_fixdelay_max_picosec'], parameters['uvjones_g_on'], parameters['uvjones_d_on'], parameters['parang_corrected'],\
-                               gR_mean, gR_std, gL_mean, gL_std, dR_mean, dR_std, dL_mean, dL_std, feed_angle, parameters['add_thermal_noise'])
+                               gR_mean, gR_std, gL_mean, gL_std, dR_mean, dR_std, dL_mean, dL_std, feed_angle, parameters['add_thermal_noise'],\
+                               fuse_corruptions=parameters.get('fuse_corruptions', 0), streaming=parameters.get('streaming', 0),\
+                               row_chunksize=parameters.get('row_chunksize', 100000), noise_workers=parameters.get('noise_workers', 1),\
+                               cache_dir=parameters.get('cache_dir', None), aatm_workers=parameters.get('aatm_workers', 0),\
+                               aatm_cache_size=parameters.get('aatm_cache_size', 100), atm_grid=parameters.get('atm_grid', None),\
+                               turbulence_method=parameters.get('turbulence_method', 'fft'),\
+                               turbulence_cache_size=parameters.get('turbulence_cache_size', 1000),\
+                               turbulence_realisations=parameters.get('turbulence_realisations', 1),\
+                               turbulence_cluster_radius=parameters.get('turbulence_cluster_radius', 0),\
+                               wind_speed=parameters.get('wind_speed', 10.),\
+                               wind_direction=parameters.get('wind_direction', 0.),\
+                               geometry_cache_size=parameters.get('geometry_cache_size', 1000))
 
     sim_coord.interferometric_sim()
 
@@ -205,10 +216,18 @@ def run_meqsilhouette(config=None):
     
     if parameters['pointing_enabled']:
         info('Pointing errors are enabled, applying antenna-based amplitudes errors')
-        info('Current pointing error model is a constant offset that changes on a user-specified time interval, current setting = %.1f minutes'%\
-             parameters['pointing_time_per_mispoint'])
-        
-        sim_coord.pointing_constant_offset(pointing_rms,parameters['pointing_time_per_mispoint'],PB_FWHM230)
+        if parameters.get('pointing_model', 'constant') == 'continuous':
+            info('Current pointing error model is a constant offset per scan plus a drift with rms %.1f arcsec and timescale %.1f seconds'%\
+                 (parameters.get('pointing_drift_rms', 0.), parameters.get('pointing_drift_timescale', 5.)))
+            sim_coord.pointing_continuous_offset(pointing_rms,PB_FWHM230,parameters.get('pointing_drift_rms', 0.),\
+                                                 parameters.get('pointing_drift_timescale', 5.))
+        elif parameters.get('pointing_model', 'constant') == 'constant':
+            info('Current pointing error model is a constant offset that changes on a user-specified time interval, current setting = %.1f minutes'%\
+                 parameters['pointing_time_per_mispoint'])
+            sim_coord.pointing_constant_offset(pointing_rms,parameters['pointing_time_per_mispoint'],PB_FWHM230)
+        else:
+            abort("pointing_model must be 'constant' or 'continuous', not '%s'"%parameters['pointing_model'])
+
         sim_coord.apply_pointing_amp_error()
 
         if parameters['pointing_makeplots']:
@@ -284,6 +303,12 @@ def run_meqsilhouette(config=None):
         # do not add trop_noise regardless of its value since trop_enabled is False
         sim_coord.add_noise(parameters['trop_enabled'], parameters['add_thermal_noise'])
 
+    ### Write additional realisations of the turbulence (if requested) to separate columns ###
+    sim_coord.write_turbulence_ensemble()
+
+    ### Apply deferred corruptions (if fused) and write the data to the MS once ###
+    sim_coord.flush_jones_chain()
+
     ### IMAGING, PLOTTING, DATA EXPORT ###        
     if parameters['make_image']:
         info('Imaging the %s column'%ms_dict['datacolumn'])
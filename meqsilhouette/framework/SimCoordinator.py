@@ -1,14 +1,23 @@
 from Pyxis.ModSupport import *
 from meqsilhouette.framework.meqtrees_funcs import run_turbosim, run_wsclean, copy_between_cols
+from meqsilhouette.framework.jones_funcs import row_time_index, apply_jones, compose_jones, diag_to_full
+from meqsilhouette.framework.atm_funcs import aatm_command, parse_aatm_output, run_aatm, load_atm_grid, interpolate_atm_grid
+from meqsilhouette.framework.turb_funcs import increment_spectrum, cholesky_factor, split_scans, turbulent_phase_fft, turbulent_phase_scans, \
+     turbulent_phase_cholesky, frozen_flow_phases
+from meqsilhouette.framework.pointing_funcs import gaussian_beam_gain, ou_process
+from meqsilhouette.framework.noise_funcs import noise_key, baseline_index, realise_noise, NoisePool, THERMAL_NOISE_STREAM, SKY_NOISE_STREAM
 import pyrap.tables as pt
 import pyrap.measures as pm, pyrap.quanta as qa
 from meqsilhouette.utils.comm_functions import *
+from meqsilhouette.utils.disk_cache import array_digest, load_cached, save_cached, evict_lru
 import pickle
 import subprocess
 import os
 import ast
+import multiprocessing
 import time
 import glob
+import itertools
 import shlex
 import tempfile
 import cmath
@@ -32,27 +41,41 @@ from cycler import cycler
 
 class SimCoordinator():
 
+    # INI: names of the arrays stored in a geometry cache entry (see __init__)
+    geometry_cache_products = ['hour_angle', 'elevation', 'parallactic_angle', 'latitude', 'baseline_index', 'mjd_ant_rise', 'mjd_ant_set']
+
     def __init__(self, msname, output_column, input_fitsimage, input_fitspol, input_changroups, bandpass_table, bandpass_freq_interp_order, T_rx, \
                  corr_eff, predict_oversampling, predict_seed, atm_seed, aperture_eff, elevation_limit, trop_enabled, trop_wetonly, pwv, \
                  gpress, gtemp, coherence_time, fixdelay_max_picosec, uvjones_g_on, uvjones_d_on, parang_corrected, gR_mean, \
-                 gR_std, gL_mean, gL_std, dR_mean, dR_std, dL_mean, dL_std, feed_angle, thermal_noise_enabled):
+                 gR_std, gL_mean, gL_std, dR_mean, dR_std, dL_mean, dL_std, feed_angle, thermal_noise_enabled, fuse_corruptions=False, \
+                 streaming=False, row_chunksize=100000, noise_workers=1, cache_dir=None, aatm_workers=0, \
+                 aatm_cache_size=100, atm_grid=None, turbulence_method='fft', turbulence_cache_size=1000, \
+                 turbulence_realisations=1, turbulence_cluster_radius=0, wind_speed=10., wind_direction=0., \
+                 geometry_cache_size=1000):
         info('Generating MS attributes based on input parameters')
         self.msname = msname
         tab = pt.table(msname, readonly=True,ack=False)
-        self.data = tab.getcol(output_column)
-        self.flag = tab.getcol('FLAG')
+        self.streaming = streaming
+        if self.streaming:
+            # INI: visibilities and flags are never held in memory; they are read, corrupted and written in chunks of rows
+            self.data = None
+            self.flag = None
+        else:
+            self.data = tab.getcol(output_column)
+            self.flag = tab.getcol('FLAG')
         self.uvw = tab.getcol("UVW")
         self.uvdist = np.sqrt(self.uvw[:, 0]**2 + self.uvw[:, 1]**2)
         self.A0 = tab.getcol('ANTENNA1')
         self.A1 = tab.getcol("ANTENNA2")
         self.time = tab.getcol('TIME')
         self.nrows = self.time.shape[0]
-        self.chunksize = 100000 # hardcoded for now
+        self.chunksize = int(row_chunksize) # number of rows processed (and held in memory, if streaming) at a time
         self.nchunks = int(np.ceil(float(self.nrows)/self.chunksize))
         self.time_unique = np.unique(self.time)
+        self.time_index = row_time_index(self.time, self.time_unique) # index into time_unique for every row
         self.mjd_obs_start = self.time_unique[0]
         self.mjd_obs_end  = self.time_unique[-1]
-        self.tint = self.time_unique[1]-self.time_unique[0]
+        self.tint = np.median(np.diff(self.time_unique)) # INI: robust to gaps between scans
         self.obslength = self.time_unique[-1]-self.time_unique[0]
         self.ant_unique = np.unique(np.hstack((self.A0, self.A1)))
 
@@ -77,13 +100,37 @@ class SimCoordinator():
         spec_tab.close()
 
         ### elevation-relevant calculation ###
+        ### INI: the geometry products depend only on the array, the schedule and the elevation limit. If cache_dir is set,
+        ### they are loaded (memory-mapped) from a cache entry keyed by these inputs, if present, instead of being recomputed.
+        ### The entries are kept in a subdirectory of cache_dir bounded to geometry_cache_size MB
+        self.cache_dir = cache_dir
+        self.geometry_cache_dir = os.path.join(self.cache_dir, 'geometry') if self.cache_dir else None
+        self.geometry_cache_size = int(geometry_cache_size * 1024**2)
+        cached = None
+        if self.geometry_cache_dir:
+            cache_key = array_digest(self.pos, self.direction, self.time, self.A0, self.A1, self.chan_freq, np.array([elevation_limit]))
+            cached = load_cached(self.geometry_cache_dir, cache_key, self.geometry_cache_products)
+        if cached is not None:
+            info('Loaded antenna geometry from cache %s'%os.path.join(self.geometry_cache_dir, cache_key))
+            self.geometry = dict((name, cached[name]) for name in ('hour_angle', 'elevation', 'parallactic_angle', 'latitude'))
+            self.baseline_index = cached['baseline_index']
+        else:
+            self.geometry = self.geometry_calc() # hour angle, elevation and parallactic angle of all antennas, computed once
+            self.baseline_index = baseline_index(self.A0, self.A1, self.Nant) # index of the baseline of every row
         self.elevation = self.elevation_calc()
         self.baseline_dict = self.make_baseline_dictionary()
         self.write_flag(elevation_limit)
-        self.elevation_copy_dterms = self.elevation.copy()
+        self.elevation_copy_dterms = self.geometry['elevation'] # unmasked elevation
         self.elevation[self.elevation < elevation_limit] = np.nan  # This is to avoid crashing later tropospheric calculation
-        self.calc_ant_rise_set_times()
-        self.parallactic_angle = self.parallactic_angle_calc() # INI: uses self.elevation
+        if cached is not None:
+            self.mjd_ant_rise, self.mjd_ant_set = cached['mjd_ant_rise'], cached['mjd_ant_set']
+        else:
+            self.calc_ant_rise_set_times()
+            if self.geometry_cache_dir:
+                save_cached(self.geometry_cache_dir, cache_key, dict(baseline_index=self.baseline_index, mjd_ant_rise=self.mjd_ant_rise,
+                                                                     mjd_ant_set=self.mjd_ant_set, **self.geometry))
+                evict_lru(self.geometry_cache_dir, self.geometry_cache_size, keep=[cache_key])
+        self.parallactic_angle = self.parallactic_angle_calc()
                                                 
         self.input_fitsimage = input_fitsimage
         self.input_fitspol = input_fitspol
@@ -102,19 +149,35 @@ class SimCoordinator():
 
         ### INI: Oversampling factor to use for visibility prediction
         self.oversampling = predict_oversampling
-        if predict_seed != -1:
-            self.rng_predict = np.random.default_rng(predict_seed)
-        else:
-            self.rng_predict = np.random.default_rng()
-        if atm_seed != -1:
-            self.rng_atm = np.random.default_rng(atm_seed)
-        else:
-            self.rng_atm = np.random.default_rng()
+        # INI: a seed of -1 is replaced by fresh entropy, which is logged so that the run can be reproduced
+        if predict_seed == -1:
+            predict_seed = np.random.SeedSequence().entropy
+            info('predict_seed = -1; using random seed %d'%predict_seed)
+        if atm_seed == -1:
+            atm_seed = np.random.SeedSequence().entropy
+            info('atm_seed = -1; using random seed %d'%atm_seed)
+        self.rng_predict = np.random.default_rng(predict_seed)
+        self.rng_atm = np.random.default_rng(atm_seed)
+
+        ### INI: thermal and sky noise are drawn from counter-based generators, so that the noise of any block of rows
+        ### can be regenerated independently of the others (see noise_funcs). Every realisation of the turbulence has its own
+        ### noise keys; the first ones are used for the output column (see write_turbulence_ensemble)
+        nkeys = max(1, int(turbulence_realisations))
+        self.thermal_noise_keys = [noise_key(predict_seed, THERMAL_NOISE_STREAM, k) for k in range(nkeys)]
+        self.sky_noise_keys = [noise_key(atm_seed, SKY_NOISE_STREAM, k) for k in range(nkeys)]
+        self.noise_workers = int(noise_workers)
+        if self.noise_workers > 1 and 'fork' not in multiprocessing.get_all_start_methods():
+            warn('Parallel noise generation requires the fork start method, which is not available on this platform. Using a single process.')
+            self.noise_workers = 1
+        self.noise_pool = None # INI: forked at the first noise draw of a stage and closed when the stage is written (see close_noise_pool)
 
         ### INI: populate WEIGHT and SIGMA columns
         self.thermal_noise_enabled = thermal_noise_enabled
-        self.receiver_rms = np.zeros(self.data.shape, dtype='float')
-        self.sky_sigma_estimator = np.zeros(self.data.shape, dtype='float')
+        # INI: the noise rms is computed for each chunk of rows as the noise is added. The generator keys and rms function
+        # of every noise term added to the data are kept, so that its noise can be regenerated for any rows (see realise_noise_terms).
+        # The terms added after the last antenna-based Jones term are also kept in trailing_noise_terms
+        self.noise_terms = []
+        self.trailing_noise_terms = []
 
         tab.close() # close main MS table
 
@@ -125,7 +188,30 @@ class SimCoordinator():
         self.average_gpress = gpress
         self.average_gtemp = gtemp
         self.coherence_time = coherence_time
+        if turbulence_method not in ('fft', 'cholesky'):
+            abort("turbulence_method must be 'fft' or 'cholesky', not '%s'"%turbulence_method)
+        self.turbulence_method = turbulence_method
+        # INI: covariance factors of the turbulence are cached in memory, and in a subdirectory of cache_dir bounded to turbulence_cache_size MB
+        self.turb_factors = {}
+        self.turb_cache_dir = os.path.join(self.cache_dir, 'turbulence') if self.cache_dir else None
+        self.turb_cache_size = int(turbulence_cache_size * 1024**2)
+        self.turbulence_realisations = int(turbulence_realisations) # number of realisations of the turbulence drawn at once
+        self.turb_phase_ensemble = None
+        # INI: stations closer than turbulence_cluster_radius (m) to each other look through a common frozen-flow phase screen,
+        # blown by a wind of wind_speed (m/s) towards wind_direction (deg east of north)
+        self.wind_speed = float(wind_speed)
+        self.wind_direction = np.deg2rad(wind_direction)
+        self.turbulence_clusters = self.station_clusters(turbulence_cluster_radius)
+        for cluster in self.turbulence_clusters:
+            if len(cluster) > 1:
+                info('Stations %s share a tropospheric phase screen'%', '.join(self.station_names[ant] for ant in cluster))
         self.fixdelay_max_picosec = fixdelay_max_picosec
+        self.aatm_workers = int(aatm_workers) # maximum number of concurrent AATM processes (0: one per CPU)
+        # INI: AATM outputs are cached in a subdirectory of cache_dir, bounded to aatm_cache_size MB
+        self.aatm_cache_dir = os.path.join(self.cache_dir, 'aatm') if self.cache_dir else None
+        self.aatm_cache_size = int(aatm_cache_size * 1024**2)
+        # INI: if an atmosphere grid (see atm_funcs.build_atm_grid) is given, it is interpolated instead of running AATM
+        self.atm_grid = load_atm_grid(atm_grid) if atm_grid else None
         self.elevation_tropshape = np.expand_dims(np.swapaxes(self.elevation, 0, 1), 1) # reshaped for troposphere operations
         self.opacity, self.emissivity = self.trop_return_opacity_emissivity()
         self.transmission = np.exp(-1*self.opacity)
@@ -137,7 +223,6 @@ class SimCoordinator():
         self.transmission_matrix = None
         self.turb_phase_errors = None
         self.delay_alltimes = None
-        self.sky_noise = None
         
         ### bandpass information
         self.bandpass_table = bandpass_table
@@ -159,6 +244,12 @@ class SimCoordinator():
         self.dL_mean = dL_mean
         self.dL_std = dL_std
 
+        ### INI: if corruptions are fused, antenna-based Jones terms are deferred and applied in a single pass.
+        ### Streaming implies fused corruptions; the deferred steps are then queued in stream_ops and applied to each chunk of rows.
+        self.fuse_corruptions = fuse_corruptions or streaming
+        self.jones_chain = []
+        self.stream_ops = []
+
         # Get timestamp at the start of the data generation
         self.timestamp = int(time.time())
 
@@ -226,9 +317,10 @@ class SimCoordinator():
         else:
             abort('Problem with input sky models.')
 
-        tab = pt.table(self.msname, readonly=True, ack=False)
-        self.data = tab.getcol(self.output_column) 
-        tab.close()
+        if not self.streaming:
+            tab = pt.table(self.msname, readonly=True, ack=False)
+            self.data = tab.getcol(self.output_column) 
+            tab.close()
 
     def copy_MS(self, new_name):
         """
@@ -249,195 +341,477 @@ class SimCoordinator():
     def save_data(self):
         """
         Saves the contents of data array to the output column specified by the user.
+        Only the active rows are written; fully flagged rows are left untouched.
         """
         tab = pt.table(self.msname, readonly=False,ack=False)
-        tab.putcol(self.output_column, self.data)
+        active_tab = self.active_table(tab)
+        for block, rows in self.active_chunks():
+            active_tab.putcol(self.output_column, self.data[rows], startrow=block.start, nrow=block.stop-block.start)
         tab.close()
-        
-    def compute_receiver_rms(self):
+        self.close_noise_pool()
+
+    def row_chunks(self):
         """
-        Populate the RMS receiver noise array. This will be later used to realise thermal noise.
+        Yield slices over the rows of the MS in blocks of at most chunksize rows.
         """
-        #if rms.shape != self.data.shape:
-        #    abort('The rms array used to populate SIGMA, SIGMA_SPECTRUM, WEIGHT, and WEIGHT_SPECTRUM does not have the expected dimensions:\n'\
-        #          'rms.shape = '+rms.shape+'. Expected dimensions: '+self.data.shape)
+        for chunk in range(self.nchunks):
+            yield slice(chunk*self.chunksize, min((chunk+1)*self.chunksize, self.nrows))
 
-        for a0 in range(self.Nant):
-            for a1 in range(self.Nant):
-                if a1 > a0:
-                    self.receiver_rms[self.baseline_dict[(a0,a1)]] = (1/self.corr_eff) * np.sqrt(self.SEFD_rx[a0] * self.SEFD_rx[a1] / float(2 * self.tint * self.chan_width))
+    def active_chunks(self):
+        """
+        Yield blocks of at most chunksize active rows, i.e. rows that are not fully flagged (see write_flag).
 
+        Yields
+        ------
+        block : slice
+            Position of the block in active_rows, i.e. the rows of the table returned by active_table.
+        rows : slice or ndarray
+            Row numbers of the block in the MS. A slice if no row is fully flagged.
+        """
+        nactive = self.active_rows.shape[0]
+        for start in range(0, nactive, self.chunksize):
+            block = slice(start, min(start+self.chunksize, nactive))
+            yield block, (block if nactive == self.nrows else self.active_rows[block])
 
-    def add_weights(self, additional_noise_terms=None):
+    def active_table(self, tab):
         """
-        Populate SIGMA, SIGMA_SPECTRUM, WEIGHT, WEIGHT_SPECTRUM columns in the MS.
+        Restrict an open MS to its active rows.
 
         Parameters
         ----------
-        additional_noise_terms : (ndarray, optional)
-            Additional noise terms to be added to the receiver RMS.
+        tab : pyrap.tables.table
+            The MS.
 
-        Raises
-        ------
-        MemoryError
-            If the arrays are too large to be held in memory.
+        Returns
+        -------
+        pyrap.tables.table
+            Reference table selecting active_rows, or tab itself if no row is fully flagged.
         """
-        #if rms.shape != self.data.shape:
-        #    abort('The rms array used to populate SIGMA, SIGMA_SPECTRUM, WEIGHT, and WEIGHT_SPECTRUM does not have the expected dimensions:\n'\
-        #          'rms.shape = '+rms.shape+'. Expected dimensions: '+self.data.shape)
+        if self.active_rows.shape[0] == self.nrows:
+            return tab
+        return tab.selectrows(self.active_rows)
 
-        if additional_noise_terms is not None:
-            try:
-                for tind in range(self.nchunks):
-                    self.receiver_rms[tind*self.chunksize:(tind+1)*self.chunksize] = np.sqrt(np.power(self.receiver_rms[tind*self.chunksize:(tind+1)*self.chunksize], 2) + np.power(additional_noise_terms[tind*self.chunksize:(tind+1)*self.chunksize], 2))
-            except MemoryError:
-                abort("Arrays too large to be held in memory. Aborting execution.")
+    def apply_cross_rows(self, op, data, rows):
+        """
+        Apply an operation to the cross-correlation rows (ANTENNA1 < ANTENNA2) of a chunk of visibilities in place.
+        Autocorrelations are not corrupted, since the antenna-based terms may be undefined (NaN) for antennas below
+        the elevation limit, while autocorrelation rows are never flagged (see write_flag).
 
+        Parameters
+        ----------
+        op : callable
+            Operation called as op(data, rows) on the cross-correlation rows, modifying data in place.
+        data : ndarray
+            Visibilities of the chunk of shape (nrow, nchan, 4), modified in place.
+        rows : slice or ndarray
+            Rows of the MS.
+        """
+        cross = self.A1[rows] > self.A0[rows]
+        if cross.all():
+            op(data, rows)
+        elif cross.any():
+            rows = (np.arange(rows.start, rows.stop) if isinstance(rows, slice) else rows)[cross]
+            cross_data = data[cross]
+            op(cross_data, rows)
+            data[cross] = cross_data
+
+    def apply_antenna_jones(self, jones, kind='scalar'):
+        """
+        Apply antenna-based Jones terms to all baselines at once and save.
+
+        The per-row time and antenna indices are used to gather the Jones terms of both antennas
+        of every row, which are then applied to the cross-correlations of each chunk of active rows with broadcasting
+        (see apply_cross_rows). If corruptions are fused, the Jones terms are only added to the chain applied later by
+        apply_jones_chain.
+
+        Parameters
+        ----------
+        jones : callable
+            Function that takes arrays of time indices and antenna indices (one entry per row) and
+            returns the Jones term of each row for that antenna, broadcastable to (nrow, nchan) for
+            kind 'scalar', to (nrow, nchan, 2) for kind 'diag' and to (nrow, nchan, 2, 2) for kind 'full'.
+        kind : str
+            Type of the Jones term, one of 'scalar', 'diag' (diagonal Jones matrices stored as 2-vectors)
+            or 'full'.
+        """
+        self.trailing_noise_terms = [] # INI: the noise added so far is corrupted by this term
+        if self.fuse_corruptions:
+            self.jones_chain.append((jones, kind))
+            return
+
+        def apply_term(data, rows):
+            tind = self.time_index[rows]
+            apply_jones(data, jones(tind, self.A0[rows]), jones(tind, self.A1[rows]), kind)
+
+        for block, rows in self.active_chunks():
+            data = self.data[rows]
+            self.apply_cross_rows(apply_term, data, rows)
+            self.data[rows] = data
+        self.save_data()
+
+    def apply_jones_chain(self):
+        """
+        Apply all deferred antenna-based Jones terms to the data in a single pass.
+
+        For every chunk of active rows, the Jones terms are composed into one product per antenna and time index
+        present in the chunk, in the order in which they were added (the last one being the outermost), and applied
+        to the visibilities once.
+        If streaming, the chain is instead queued in stream_ops and applied to each chunk as it is read.
+        """
+        if not self.jones_chain:
+            return
+        jones_chain, self.jones_chain = self.jones_chain, []
+
+        def chain_product(tind, ant):
+            product, product_kind = jones_chain[0][0](tind, ant), jones_chain[0][1]
+            for jones, kind in jones_chain[1:]:
+                product, product_kind = compose_jones(jones(tind, ant), kind, product, product_kind)
+            return product, product_kind
+
+        def apply_chain(data, rows):
+            # compose the chain once per (antenna, time index) pair of the chunk and gather to rows
+            tind = self.time_index[rows]
+            ntime = tind.max() + 1
+            pairs, inverse = np.unique(np.concatenate((self.A0[rows] * ntime + tind, self.A1[rows] * ntime + tind)),
+                                       return_inverse=True)
+            product, kind = chain_product(pairs % ntime, pairs // ntime)
+            apply_jones(data, product[inverse[:tind.shape[0]]], product[inverse[tind.shape[0]:]], kind)
+
+        if self.streaming:
+            self.stream_ops.append(lambda tab, data, block, rows: self.apply_cross_rows(apply_chain, data, rows))
+            return
+
+        info('Applying %d fused antenna-based Jones terms to data...'%len(jones_chain))
+        for block, rows in self.active_chunks():
+            data = self.data[rows]
+            self.apply_cross_rows(apply_chain, data, rows)
+            self.data[rows] = data
+
+    def flush_jones_chain(self):
+        """
+        Apply any deferred antenna-based Jones terms and write the (corrupted and noise-added) data
+        to the MS. Does nothing unless corruptions are fused.
+        """
+        if self.fuse_corruptions:
+            self.apply_jones_chain()
+            if self.streaming:
+                self.stream_data()
+            else:
+                self.save_data()
+
+    def stream_data(self):
+        """
+        Read the output column of the MS in chunks of active rows, apply all queued corruptions (stream_ops) in order
+        and write each chunk back, so that only one chunk of visibilities is held in memory at a time. Every step is
+        called as op(tab, data, block, rows), with tab restricted to the active rows and block, rows as yielded by
+        active_chunks.
+        """
+        if not self.stream_ops:
+            return
+
+        info('Streaming %d active rows through %d corruption step(s)...'%(self.active_rows.shape[0], len(self.stream_ops)))
         tab = pt.table(self.msname, readonly=False, ack=False)
-        tab.putcol("SIGMA", self.receiver_rms[:,0,:])
-        if 'SIGMA_SPECTRUM' in tab.colnames():
-            tab.putcol("SIGMA_SPECTRUM", self.receiver_rms)
-        tab.putcol("WEIGHT", 1/self.receiver_rms[:,0,:]**2)
-        if 'WEIGHT_SPECTRUM' in tab.colnames():
-            tab.putcol("WEIGHT_SPECTRUM", 1/self.receiver_rms**2)
+        active_tab = self.active_table(tab)
+        for block, rows in self.active_chunks():
+            nrow = block.stop - block.start
+            data = active_tab.getcol(self.output_column, startrow=block.start, nrow=nrow)
+            for op in self.stream_ops:
+                op(active_tab, data, block, rows)
+            active_tab.putcol(self.output_column, data, startrow=block.start, nrow=nrow)
         tab.close()
+        self.stream_ops = []
+        self.close_noise_pool()
 
+    def receiver_rms_rows(self, rows):
+        """
+        Compute the receiver (thermal) noise rms of a chunk of rows from the SEFDs of both antennas.
+
+        Parameters
+        ----------
+        rows : slice or ndarray
+            Rows of the MS.
+
+        Returns
+        -------
+        ndarray
+            Noise rms of shape (nrow, nchan, 4). Rows that are not cross-correlations have zero rms.
+        """
+        a0, a1 = self.A0[rows], self.A1[rows]
+        rms = (1/self.corr_eff) * np.sqrt(self.SEFD_rx[a0] * self.SEFD_rx[a1] / float(2 * self.tint * self.chan_width))
+        rms[a1 <= a0] = 0.
+        return np.broadcast_to(rms[:, np.newaxis, np.newaxis], (rms.shape[0], self.num_chan, 4))
 
-    def add_receiver_noise(self, load=None):
+    def sky_rms_rows(self, sefd_matrix, rows):
         """
-        Adds baseline dependent thermal noise to the data.
+        Compute the sky noise rms of a chunk of rows from the time- and frequency-dependent SEFDs of both antennas.
 
         Parameters
         ----------
-        load : (bool, optional)
-            If True, loads the thermal noise from a file. Defaults to None.
+        sefd_matrix : ndarray
+            SEFD of shape (Ntime, Nchan, Nant).
+        rows : slice or ndarray
+            Rows of the MS.
 
-        Raises
-        ------
-        MemoryError
-            If the arrays are too large to be held in memory.
+        Returns
+        -------
+        ndarray
+            Noise rms of shape (nrow, nchan, 4). Rows that are not cross-correlations have zero rms.
         """
-        if load:
-            self.thermal_noise = np.load(II('$OUTDIR')+'/receiver_noise.npy')
+        tind, a0, a1 = self.time_index[rows], self.A0[rows], self.A1[rows]
+        rms = (1/self.corr_eff) * np.sqrt(sefd_matrix[tind, :, a0] * sefd_matrix[tind, :, a1] / float(2 * self.tint * self.chan_width))
+        rms[a1 <= a0] = 0.
+        return np.broadcast_to(rms[:, :, np.newaxis], rms.shape + (4,))
+
+    def realise_noise_rows(self, key, rms, rows):
+        """
+        Realise complex noise for a chunk of rows from a counter-based generator. The noise of every row depends
+        only on the key, its timestamp and its baseline, and not on how the rows are chunked. If noise_workers > 1,
+        the rows are split into blocks that are realised by a pool of worker processes, which is forked at the first
+        call and reused until close_noise_pool.
+
+        Parameters
+        ----------
+        key : ndarray
+            Key of the noise generator (e.g. one of thermal_noise_keys or sky_noise_keys).
+        rms : ndarray
+            Noise rms of shape (nrow, nchan, 4).
+        rows : slice or ndarray
+            Rows of the MS.
+
+        Returns
+        -------
+        ndarray
+            Complex noise of shape (nrow, nchan, 4).
+        """
+        time_index, bl_index = self.time_index[rows], self.baseline_index[rows]
+        if self.noise_workers > 1:
+            if self.noise_pool is None:
+                self.noise_pool = NoisePool(self.noise_workers, self.chunksize, (self.num_chan, 4))
+            return self.noise_pool.realise(key, rms, time_index, bl_index, int(self.nbl))
+        return realise_noise(key, rms, time_index, bl_index, int(self.nbl))
+
+    def close_noise_pool(self):
+        """
+        Terminate the noise worker processes, if any. Called once the noise of a stage has been written to the MS.
+        """
+        if self.noise_pool is not None:
+            self.noise_pool.close()
+            self.noise_pool = None
+
+    def realise_noise_terms(self, terms, rows, realisation=0):
+        """
+        Realise the sum of independent noise terms for a chunk of rows, together with its total rms. Since the noise
+        is counter-based (see realise_noise_rows), the noise added to the data can be regenerated in this way for any
+        rows, without being kept in memory.
+
+        Parameters
+        ----------
+        terms : list of tuple
+            (keys, rms_rows) of every noise term: the keys of its generator for every realisation (e.g. thermal_noise_keys)
+            and a function that returns its rms of shape (nrow, nchan, 4) for a chunk of rows (e.g. receiver_rms_rows).
+        rows : slice or ndarray
+            Rows of the MS.
+        realisation : int
+            Realisation of the noise; 0 is the noise of the output column.
+
+        Returns
+        -------
+        noise : ndarray or float
+            Complex noise of shape (nrow, nchan, 4), or 0 if there are no noise terms.
+        rms : ndarray
+            Total noise rms of shape (nrow, nchan, 4).
+        """
+        noise, rms = 0., np.broadcast_to(0., (self.time_index[rows].shape[0], self.num_chan, 4))
+        for keys, rms_rows in terms:
+            term_rms = rms_rows(rows)
+            noise = noise + self.realise_noise_rows(keys[realisation], term_rms, rows)
+            rms = np.sqrt(rms**2 + term_rms**2)
+        return noise, rms
+
+    def apply_row_op(self, op):
+        """
+        Apply an operation to every chunk of active rows, as op(tab, data, block, rows) with tab the active rows of the
+        MS opened for writing (see stream_data). When streaming, the operation is queued in stream_ops instead.
+
+        Parameters
+        ----------
+        op : callable
+            Operation that modifies a chunk of visibilities in place.
+        """
+        if self.streaming:
+            self.stream_ops.append(op)
+            return
+
+        tab = pt.table(self.msname, readonly=False, ack=False)
+        active_tab = self.active_table(tab)
+        for block, rows in self.active_chunks():
+            data = self.data[rows]
+            op(active_tab, data, block, rows)
+            self.data[rows] = data
+        tab.close()
+
+    def put_sigma_weight(self, tab, rms, noise_added, startrow=0):
+        """
+        Write the SIGMA, SIGMA_SPECTRUM, WEIGHT and WEIGHT_SPECTRUM columns of a block of rows.
+
+        Parameters
+        ----------
+        tab : pyrap.tables.table
+            The MS (or its active rows, see active_table), opened for writing.
+        rms : ndarray
+            Noise rms of shape (nrow, nchan, 4).
+        noise_added : bool
+            If False, no noise was added and the weights are set to rms+1 instead of 1/rms**2.
+        startrow : int
+            First row of the block.
+        """
+        nrow = rms.shape[0]
+        tab.putcol("SIGMA", rms[:,0,:], startrow=startrow, nrow=nrow)
+        if 'SIGMA_SPECTRUM' in tab.colnames():
+            tab.putcol("SIGMA_SPECTRUM", rms, startrow=startrow, nrow=nrow)
+
+        if not noise_added:
+            tab.putcol("WEIGHT", rms[:,0,:]+1, startrow=startrow, nrow=nrow)
+            if 'WEIGHT_SPECTRUM' in tab.colnames():
+                tab.putcol("WEIGHT_SPECTRUM", rms+1, startrow=startrow, nrow=nrow)
         else:
-            info('Instantiating thermal noise...')
-            self.thermal_noise = np.zeros(self.data.shape, dtype='complex')
-            size = (self.time_unique.shape[0], self.chan_freq.shape[0], 4)
-            for a0 in range(self.Nant):
-                for a1 in range(self.Nant):
-                    if a1 > a0:
-                        rms = self.receiver_rms[self.baseline_dict[(a0,a1)]]
-                        self.thermal_noise[self.baseline_dict[(a0, a1)]] = self.rng_predict.normal(0.0, rms, size=size) + 1j * self.rng_predict.normal(0.0, rms, size=size)
-
-            np.save(II('$OUTDIR')+'/receiver_noise_timestamp_%d'%(self.timestamp), self.thermal_noise)
-        try:
-            info('Applying thermal noise to data...')
-            for tind in range(self.nchunks):
-                self.data[tind*self.chunksize:(tind+1)*self.chunksize] += self.thermal_noise[tind*self.chunksize:(tind+1)*self.chunksize]
+            tab.putcol("WEIGHT", 1/rms[:,0,:]**2, startrow=startrow, nrow=nrow)
+            if 'WEIGHT_SPECTRUM' in tab.colnames():
+                tab.putcol("WEIGHT_SPECTRUM", 1/rms**2, startrow=startrow, nrow=nrow)
+
+    def add_weights(self):
+        """
+        Populate SIGMA, SIGMA_SPECTRUM, WEIGHT, WEIGHT_SPECTRUM columns of the active rows in the MS with the total rms of
+        the noise added to the data so far (see noise_terms).
+        """
+        tab = pt.table(self.msname, readonly=False, ack=False)
+        active_tab = self.active_table(tab)
+        for block, rows in self.active_chunks():
+            self.put_sigma_weight(active_tab, self.noise_rms_rows(rows), True, startrow=block.start)
+        tab.close()
+
+    def noise_rms_rows(self, rows):
+        """
+        Compute the total rms of the noise added to the data so far (see noise_terms) for a chunk of rows.
+
+        Parameters
+        ----------
+        rows : slice or ndarray
+            Row numbers of the chunk in the MS.
+
+        Returns
+        -------
+        ndarray
+            The rms of shape (nrows in chunk, nchan, 4).
+        """
+        rms = np.broadcast_to(0., (self.time_index[rows].shape[0], self.num_chan, 4))
+        for keys, rms_rows in self.noise_terms:
+            rms = np.sqrt(rms**2 + rms_rows(rows)**2)
+        return rms
+
+
+    def add_receiver_noise(self):
+        """
+        Adds baseline dependent thermal noise to the data. The noise of every chunk of rows is realised from the SEFDs of
+        both antennas and added in place; neither the noise nor its rms is kept.
+        """
+        self.apply_jones_chain() # noise is added after any deferred Jones terms
+        info('Thermal noise is realised for each chunk of rows; it is not saved to disk.')
+        terms = [(self.thermal_noise_keys, self.receiver_rms_rows)]
+        self.noise_terms += terms
+        self.trailing_noise_terms += terms
+
+        def add_receiver_noise_rows(tab, data, block, rows):
+            data += self.realise_noise_terms(terms, rows)[0]
+
+        info('Applying thermal noise to data...')
+        self.apply_row_op(add_receiver_noise_rows)
+        if not self.fuse_corruptions:
             self.save_data()
-        except MemoryError:
-            abort("Arrays too large to be held in memory. Aborting execution.")
 
         
     def make_baseline_dictionary(self):
         """
         Creates and returns a dictionary of baselines for the current instance.
 
+        The rows are grouped by baseline in a single pass, using a stable argsort of a packed (ANTENNA1, ANTENNA2)
+        key, so that the rows of every baseline remain in time order.
+
         Returns
         -------
         dict
-            A dictionary with all baselines present in the observation.
-
-        Raises
-        ------
-        Exception
-            If the baseline dictionary cannot be created for any reason.
+            A dictionary with the row indices of every baseline (a0, a1) with a0 < a1. Baselines without any
+            rows map to an empty array.
         """
+        baseline_dict = dict([((x, y), np.array([], dtype=int)) for x in range(self.Nant) for y in range(self.Nant) if y > x])
 
-        return dict([((x, y), np.where((self.A0 == x) & (self.A1 == y))[0])
-                    for x in self.ant_unique for y in self.ant_unique if y > x])
+        baseline_key = self.A0 * self.Nant + self.A1
+        order = np.argsort(baseline_key, kind='stable')
+        keys, starts = np.unique(baseline_key[order], return_index=True)
+        for key, rows in zip(keys, np.split(order, starts[1:])):
+            if key // self.Nant < key % self.Nant:
+                baseline_dict[(key // self.Nant, key % self.Nant)] = rows
+        return baseline_dict
 
-    def parallactic_angle_calc(self):
+    def geometry_calc(self):
         """
-        Calculates and returns the parallactic angle.
+        Calculates the hour angle, elevation and parallactic angle of the source for all antennas and timestamps
+        in a single vectorised pass. Only the hour angle at the start of the observation is computed per antenna
+        using casacore measures, in one shared reference frame.
 
         Returns
         -------
-        parang_matrix : ndarray
-            The computed parallactic angle matrix for each antenna during the course of the observation.
-
-        Raises
-        ------
-        Exception
-            If the parallactic angle cannot be computed for any reason.
-        """    
+        geometry : dict
+            'hour_angle', 'elevation' and 'parallactic_angle' arrays of shape (Nant, Ntime) and 'latitude' of
+            shape (Nant,), all in radians.
+        """
         measure = pm.measures()
         ra = qa.quantity(self.direction[0], 'rad'); dec = qa.quantity(self.direction[1], 'rad')
         pointing = measure.direction('j2000', ra, dec)
         start_time = measure.epoch('utc', qa.quantity(self.time_unique[0], 's'))
         measure.doframe(start_time)
 
-        parang_matrix = np.zeros((self.Nant, self.time_unique.shape[0]))
-
-        def antenna_parang(antenna):
-            x = qa.quantity(self.pos[antenna, 0], 'm')
-            y = qa.quantity(self.pos[antenna, 1], 'm')
-            z = qa.quantity(self.pos[antenna, 2], 'm')
-            position = measure.position('wgs84', x, y, z)
-            measure.doframe(position)
-            sec2rad = 2 * np.pi / (24 * 3600.)
-            hour_angle = measure.measure(pointing, 'HADEC')['m0']['value'] +\
-                         (self.time_unique-self.time_unique.min()) * sec2rad
-            earth_radius = 6371000.0
-            latitude = np.arcsin(self.pos[antenna, 2]/earth_radius)
-            return np.arctan2(np.sin(hour_angle)*np.cos(latitude), (np.cos(self.direction[1])*np.sin(latitude)-np.cos(hour_angle)*np.cos(latitude)*\
-                   np.sin(self.direction[1])))
+        start_hour_angle = np.zeros(self.Nant)
+        for ant in range(self.Nant):
+            x = qa.quantity(self.pos[ant, 0], 'm')
+            y = qa.quantity(self.pos[ant, 1], 'm')
+            z = qa.quantity(self.pos[ant, 2], 'm')
+            measure.doframe(measure.position('wgs84', x, y, z))
+            start_hour_angle[ant] = measure.measure(pointing, 'HADEC')['m0']['value']
+
+        sec2rad = 2 * np.pi / (24 * 3600.)
+        hour_angle = start_hour_angle[:, np.newaxis] + ((self.time_unique-self.time_unique.min()) * sec2rad)[np.newaxis, :]
+        earth_radius = 6371000.0
+        latitude = np.arcsin(self.pos[:, 2]/earth_radius)
+        lat = latitude[:, np.newaxis]
+        dec = self.direction[1]
 
-        for i in range(self.Nant):
-            parang_matrix[i] = antenna_parang(i)
+        elevation = np.arcsin(np.sin(lat)*np.sin(dec)+np.cos(lat)*np.cos(dec)*np.cos(hour_angle))
+        parallactic_angle = np.arctan2(np.sin(hour_angle)*np.cos(lat), (np.cos(dec)*np.sin(lat)-np.cos(hour_angle)*np.cos(lat)*np.sin(dec)))
+
+        return {'hour_angle': hour_angle, 'elevation': elevation, 'parallactic_angle': parallactic_angle, 'latitude': latitude}
+
+    def parallactic_angle_calc(self):
+        """
+        Returns the parallactic angle from the antenna geometry computed by geometry_calc.
 
-        return parang_matrix
+        Returns
+        -------
+        parang_matrix : ndarray
+            The computed parallactic angle matrix for each antenna during the course of the observation.
+        """    
+        return self.geometry['parallactic_angle'].copy()
     
     def elevation_calc(self):
         """
-        Calculates and returns the elevation angle.
+        Returns the elevation angle from the antenna geometry computed by geometry_calc.
 
         Returns
         -------
         elevation_ant_matrix : ndarray
             The computed elevation angle matrix for each antenna during the course of the observation.
-
-        Raises
-        ------
-        Exception
-            If the elevation angle cannot be computed for any reason.
         """ 
-        measure = pm.measures()
-        ra = qa.quantity(self.direction[0], 'rad'); dec = qa.quantity(self.direction[1], 'rad')
-        pointing = measure.direction('j2000', ra, dec)
-        start_time = measure.epoch('utc', qa.quantity(self.time_unique[0], 's'))
-        measure.doframe(start_time)
-
-        elevation_ant_matrix = np.zeros((self.Nant, self.time_unique.shape[0]))
-
-        def antenna_elevation(antenna):
-            x = qa.quantity(self.pos[antenna, 0], 'm')
-            y = qa.quantity(self.pos[antenna, 1], 'm')
-            z = qa.quantity(self.pos[antenna, 2], 'm')
-            position = measure.position('wgs84', x, y, z)
-            measure.doframe(position)
-            sec2rad = 2 * np.pi / (24 * 3600.)
-            hour_angle = measure.measure(pointing, 'HADEC')['m0']['value'] +\
-                         (self.time_unique-self.time_unique.min()) * sec2rad
-            earth_radius = 6371000.0
-            latitude = np.arcsin(self.pos[antenna, 2]/earth_radius)
-            return np.arcsin(np.sin(latitude)*np.sin(self.direction[1])+np.cos(latitude)*np.cos(self.direction[1]) *
-                             np.cos(hour_angle))
-
-        for i in range(self.Nant):
-            elevation_ant_matrix[i] = antenna_elevation(i)
-    
-        return elevation_ant_matrix
+        return self.geometry['elevation'].copy()
 
 
     def calc_ant_rise_set_times(self):
@@ -463,11 +837,9 @@ class SimCoordinator():
         temp_elevation = self.elevation.copy()
         temp_elevation[np.isnan(temp_elevation)] = 1000. # set nan's high. Flags used in plotting
         #elevation_mask = temp_elevation < 90.
-        for ant0 in range(self.Nant):
-            for ant1 in range(self.Nant):
-                if (ant1 > ant0):
-                    self.baseline_min_elevation[self.baseline_dict[(ant0,ant1)]] = \
-                        np.min(np.vstack([temp_elevation[ant0, :], temp_elevation[ant1, :]]), axis=0)
+        cross = self.A1 > self.A0
+        tind = self.time_index[cross]
+        self.baseline_min_elevation[cross] = np.min(np.vstack([temp_elevation[self.A0[cross], tind], temp_elevation[self.A1[cross], tind]]), axis=0)
 
 
     def calculate_baseline_mean_elevation(self):
@@ -478,52 +850,60 @@ class SimCoordinator():
         temp_elevation = self.elevation.copy()
         temp_elevation[np.isnan(temp_elevation)] = 1000. # set nan's high. Flags used in plotting
         #elevation_mask = temp_elevation < 90.
-        for ant0 in range(self.Nant):
-            for ant1 in range(self.Nant):
-                if (ant1 > ant0):
-                    self.baseline_mean_elevation[self.baseline_dict[(ant0,ant1)]] = \
-                        np.mean(np.vstack([temp_elevation[ant0, :], temp_elevation[ant1, :]]), axis=0)
+        cross = self.A1 > self.A0
+        tind = self.time_index[cross]
+        self.baseline_mean_elevation[cross] = np.mean(np.vstack([temp_elevation[self.A0[cross], tind], temp_elevation[self.A1[cross], tind]]), axis=0)
 
     
     def write_flag(self, elevation_limit):
         """ 
-        flag data if below user-specified elevation limit
+        flag data if below user-specified elevation limit, and find the active rows, i.e. the rows that are not fully
+        flagged. All corruptions, noise and writes are restricted to the active rows.
         """
-        for a0 in range(self.Nant):
-            for a1 in range(self.Nant):
-                if a1 > a0:
-                    flag_mask = np.invert(((self.elevation[a1] > elevation_limit) &
-                                           (self.elevation[a0] > elevation_limit)) > 0)
-                    self.flag[self.baseline_dict[(a0, a1)]] = flag_mask.reshape((flag_mask.shape[0], 1, 1))
-
         tab = pt.table(self.msname, readonly=False,ack=False)
-        tab.putcol("FLAG", self.flag)
+        self.row_flag = np.zeros(self.nrows, dtype=bool) # flag of the first channel and correlation of every row (used in plotting)
+        row_active = np.zeros(self.nrows, dtype=bool)
+        for rows in self.row_chunks():
+            nrow = rows.stop - rows.start
+            flag = tab.getcol('FLAG', startrow=rows.start, nrow=nrow) if self.streaming else self.flag[rows]
+            tind, a0, a1 = self.time_index[rows], self.A0[rows], self.A1[rows]
+            cross = a1 > a0 # autocorrelations keep their flags
+            flag_mask = np.invert((self.elevation[a1[cross], tind[cross]] > elevation_limit) &
+                                  (self.elevation[a0[cross], tind[cross]] > elevation_limit))
+            flag[cross] = flag_mask.reshape((flag_mask.shape[0], 1, 1))
+            self.row_flag[rows] = flag[:, 0, 0]
+            row_active[rows] = np.logical_not(flag.all(axis=(1, 2)))
+            if self.streaming:
+                tab.putcol("FLAG", flag, startrow=rows.start, nrow=nrow)
+
+        if not self.streaming:
+            tab.putcol("FLAG", self.flag)
         info('FLAG column re-written using antenna elevation limit(s)')
         tab.close()
 
+        self.active_rows = np.flatnonzero(row_active) # rows with at least one unflagged visibility
+        info('%d of %d rows are fully flagged and will not be corrupted'%(self.nrows-self.active_rows.shape[0], self.nrows))
+
 
     def trop_opacity_attenuate(self):
         """
-        Calculates attenuation due to tropospheric opacity and applies to data.
+        Calculates attenuation due to tropospheric opacity and applies to data. The voltage attenuation sqrt(T) of
+        every antenna is applied through the antenna Jones engine, so that each visibility is scaled by
+        sqrt(T_a0 T_a1) chunk by chunk, without a data-sized transmission array.
         """
-        transmission_matrix = np.exp(-1 * self.opacity / np.sin(self.elevation_tropshape))
-        np.save(II('$OUTDIR')+'/transmission_timestamp_%d'%(self.timestamp), transmission_matrix)
+        self.transmission_matrix = np.exp(-1 * self.opacity / np.sin(self.elevation_tropshape))
+        np.save(II('$OUTDIR')+'/transmission_timestamp_%d'%(self.timestamp), self.transmission_matrix)
 
-        transmission_matrix = np.expand_dims(transmission_matrix, 3)
-        self.transmission_matrix = transmission_matrix
-        transmission_column = np.zeros(self.data.shape)
-        for a0 in range(self.Nant):
-            for a1 in range(self.Nant):
-                if a1 > a0:
-                    transmission_column[self.baseline_dict[(a0, a1)]] = np.sqrt(transmission_matrix[:, :, a0, :] * transmission_matrix[:, :, a1, :])
-
-        self.data = np.multiply(self.data, transmission_column)
-        self.save_data()
+        amplitude = np.sqrt(self.transmission_matrix) # voltage attenuation per antenna
+        self.apply_antenna_jones(lambda tind, ant: amplitude[tind, :, ant])
 
 
     def trop_return_opacity_emissivity(self):
         """
-        Calculates and returns opacity and sky temperature using the external program AATM.
+        Calculates and returns opacity and sky temperature using the external program AATM, or by interpolating the
+        atmosphere grid, if given.
+        The program is run concurrently, once for every unique set of station weather parameters, unless its
+        output is in the AATM cache (see run_aatm).
 
         Returns
         -------
@@ -534,30 +914,28 @@ class SimCoordinator():
         """
         opacity, emissivity = np.zeros((2, 1, self.chan_freq.shape[0], self.Nant))
 
+        if not os.path.exists(II('$OUTDIR')+'/atm_output/'):
+            os.makedirs(II('$OUTDIR')+'/atm_output/')
+
+        if self.atm_grid is not None:
+            info('Interpolating tropospheric opacity and emissivity from the atmosphere grid...')
+            dry, wet = self.atm_grid_spectra('dry_opacity'), self.atm_grid_spectra('wet_opacity')
+            opacity[0] = wet if self.trop_wetonly == 1 else dry + wet
+            emissivity[0] = self.atm_grid_spectra('emissivity')
+            return opacity, emissivity
+
+        commands = self.aatm_commands('absorption')
+        outputs = run_aatm(commands, self.aatm_workers, self.aatm_cache_dir, self.aatm_cache_size)
+
         for ant in range(self.Nant):
-            if not os.path.exists(II('$OUTDIR')+'/atm_output/'):
-                os.makedirs(II('$OUTDIR')+'/atm_output/')
-
-            fmin,fmax,fstep = (self.chan_freq[0]-(self.chan_width)) / 1e9,\
-                              (self.chan_freq[-1]) / 1e9, \
-                              self.chan_width/1e9    # note that fmin output != self.chan_freq
-            ATM_abs_string = 'absorption --fmin %f --fmax %f --fstep %f --pwv %f --gpress %f --gtemp %f' %\
-                             (fmin, fmax, fstep, self.average_pwv[ant], \
-                              self.average_gpress[ant],self.average_gtemp[ant])
-            
-            #output = subprocess.check_output(self.ATM_absorption_string(self.chan_freq[0]-self.chan_width, self.chan_freq[-1], self.chan_width,self.average_pwv[ant], self.average_gpress[ant],self.average_gtemp[ant]),shell=True)
-            output = subprocess.check_output(ATM_abs_string,shell=True)
             atmfile = open(II('$OUTDIR')+'/atm_output/ATMstring_ant%i.txt'%ant,'w')
-            print(ATM_abs_string, file=atmfile)
+            print(commands[ant], file=atmfile)
             atmfile.close()
 
             with open(II('$OUTDIR')+'/atm_output/%satm_abs.txt'%ant, 'wb') as atm_abs:
-                atm_abs.write(output)
+                atm_abs.write(outputs[commands[ant]])
 
-            if self.num_chan == 1:
-                freq_atm, dry, wet, emissivity_per_ant = np.swapaxes(np.expand_dims(np.loadtxt(II('$OUTDIR')+'/atm_output/%satm_abs.txt'%ant, skiprows=1, usecols=[0, 1, 2, 3], delimiter=', \t'), axis=0), 0, 1)
-            else:
-                freq_atm,dry, wet, emissivity_per_ant = np.swapaxes(np.loadtxt(II('$OUTDIR')+'/atm_output/%satm_abs.txt'%ant, skiprows=1, usecols=[0, 1, 2, 3], delimiter=', \t'), 0, 1)
+            freq_atm, dry, wet, emissivity_per_ant = parse_aatm_output(outputs[commands[ant]], [0, 1, 2, 3]).T
             # the following catch is due to a bug in the ATM package
             # which results in an incorrect number of channels returned.
             # The following section just checks and corrects for that. 
@@ -580,43 +958,82 @@ class SimCoordinator():
             emissivity[:, :, ant] = emissivity_per_ant
         return opacity, emissivity
 
+    def atm_grid_spectra(self, quantity):
+        """
+        Interpolate a quantity of the atmosphere grid at the weather parameters of all antennas and the channel frequencies.
 
-    def trop_add_sky_noise(self, load=None):
-        """ for non-zero tropospheric opacity, calc sky noise"""
+        Parameters
+        ----------
+        quantity : str
+            One of the quantities in ATM_GRID_QUANTITIES (see atm_funcs).
 
-        if load:
-            """this option to load same noise not available in new MeqSilhouette version"""
-            self.sky_noise = np.load(II('$OUTDIR')+'/atm_output/sky_noise.npy')
+        Returns
+        -------
+        ndarray
+            The quantity of shape (Nchan, Nant).
+        """
+        try:
+            return interpolate_atm_grid(self.atm_grid, quantity, self.average_pwv, self.average_gpress, self.average_gtemp, self.chan_freq/1e9).T
+        except ValueError as err:
+            abort('Station weather parameters or channel frequencies lie outside the atmosphere grid: %s'%err)
 
-        else:
+    def aatm_commands(self, program):
+        """
+        Build the AATM command line of every antenna for the frequency grid of the MS and the station weather parameters.
 
-            sefd_matrix = 2 * Boltzmann / self.dish_area * (1e26*self.emissivity * (1. - np.exp(-1.0 * self.opacity / np.sin(self.elevation_tropshape))))
-            self.sky_noise = np.zeros(self.data.shape, dtype='complex')
-            sky_sigma_estimator = np.zeros(self.data.shape)
-
-            for a0 in range(self.Nant):
-                for a1 in range(self.Nant):
-                    if a1 > a0:
-                        rms = (1/self.corr_eff) * np.sqrt(sefd_matrix[:, :, a0] * sefd_matrix[:, :, a1] / (float(2 * self.tint * self.chan_width)))
-                        self.temp_rms = rms
-                        rms = np.expand_dims(rms, 2)
-                        rms = rms * np.ones((1, 1, 4))
-                        self.sky_noise[self.baseline_dict[(a0, a1)]] = self.rng_atm.normal(0.0, rms) + 1j * self.rng_atm.normal(0.0, rms)
-                        sky_sigma_estimator[self.baseline_dict[(a0, a1)]] = rms
-            np.save(II('$OUTDIR')+'/atm_output/sky_noise_timestamp_%d'%(self.timestamp), self.sky_noise)
-        try:
-          for tind in range(self.nchunks):
-            self.data[tind*self.chunksize:(tind+1)*self.chunksize] += self.sky_noise[tind*self.chunksize:(tind+1)*self.chunksize]          
-          self.save_data()
-        except:
-          abort("Arrays too large to be held in memory. Aborting execution.")
+        Parameters
+        ----------
+        program : str
+            AATM program, 'absorption' or 'dispersive'.
+
+        Returns
+        -------
+        list of str
+            Command line of every antenna. Antennas with identical weather parameters have identical commands.
+        """
+        fmin,fmax,fstep = (self.chan_freq[0]-(self.chan_width)) / 1e9,\
+                          (self.chan_freq[-1]) / 1e9, \
+                          self.chan_width/1e9    # note that fmin output != self.chan_freq
+        return [aatm_command(program, fmin, fmax, fstep, self.average_pwv[ant], self.average_gpress[ant], self.average_gtemp[ant]) \
+                for ant in range(self.Nant)]
 
-        return sky_sigma_estimator
+
+    def trop_add_sky_noise(self):
+        """
+        For non-zero tropospheric opacity, calculate the sky noise and add it to the data. The noise of every chunk of rows
+        is realised from the sky SEFDs of both antennas and added in place; only the per-antenna SEFDs are saved. The
+        sky noise rms is included in the weights written by add_weights.
+        """
+        self.apply_jones_chain() # noise is added after any deferred Jones terms
+        info('Sky noise is realised for each chunk of rows; it is not saved to disk.')
+        sefd_matrix = 2 * Boltzmann / self.dish_area * (1e26*self.emissivity * (1. - np.exp(-1.0 * self.opacity / np.sin(self.elevation_tropshape))))
+        np.save(II('$OUTDIR')+'/atm_output/sky_sefd_matrix_timestamp_%d'%(self.timestamp), sefd_matrix)
+        terms = [(self.sky_noise_keys, lambda rows: self.sky_rms_rows(sefd_matrix, rows))]
+        self.noise_terms += terms
+        self.trailing_noise_terms += terms
+
+        def add_sky_noise_rows(tab, data, block, rows):
+            data += self.realise_noise_terms(terms, rows)[0]
+
+        self.apply_row_op(add_sky_noise_rows)
+        if not self.fuse_corruptions:
+            self.save_data()
         
 
     def trop_generate_turbulence_phase_errors(self):
         """
-        Generates phase offsets/errors due to tropospheric turbulence and save to file.
+        Generates phase offsets/errors due to tropospheric turbulence and save to file. The turbulent phase of every
+        antenna follows a 5/3 power-law structure function set by its coherence time, and is generated either by
+        circulant embedding with FFTs (turbulence_method 'fft') or from the dense Cholesky factor of its covariance
+        matrix (turbulence_method 'cholesky'). Both work on the actual timestamps: with 'fft', an observation with
+        gaps between scans is generated scan by scan, conditioned on the phases at the scan ends (see
+        turbulent_phase_scans), so that the cost scales with the on-source time; with 'cholesky', the covariance is
+        evaluated at the actual time lags. Stations in a cluster of co-located stations (see station_clusters) instead
+        share a frozen-flow phase screen (see screen_turbulence_phases), whatever the turbulence_method.
+
+        If turbulence_realisations > 1, all realisations are drawn in one batch per antenna. The first one is returned
+        in turb_phase_errors as usual; the phases of the others relative to it are kept in turb_phase_ensemble and
+        written out by write_turbulence_ensemble.
 
         Returns
         -------
@@ -630,22 +1047,229 @@ class SimCoordinator():
         turb_phase_errors = np.zeros((self.time_unique.shape[0], self.chan_freq.shape[0], self.Nant))
         beta = 5/3. # power law index
 
-        time_indices = np.arange(self.time_unique.shape[0]) # INI: to index the autocorrelation function
         time_in_secs = self.time_unique - self.time_unique[0] # to compute the structure function
-        (x,y) = np.meshgrid(time_indices, time_indices)
+        if self.turbulence_method == 'fft':
+            # INI: the turbulence is generated on a uniform grid with the integration time as sampling interval,
+            # scan by scan if the observation has gaps (so that the cost does not grow with the off-source time)
+            nscans = len(split_scans(time_in_secs, self.tint))
+            grid_index = np.rint(time_in_secs / self.tint).astype(int)
+            nsamples = grid_index[-1] + 1
+
+        nreal = self.turbulence_realisations if self.turbulence_realisations > 1 else None
+        if nreal:
+            # INI: phases of realisations 1..nreal-1 relative to realisation 0 at the first channel
+            turb_phase_ensemble = np.zeros((nreal-1, self.time_unique.shape[0], self.Nant))
+
+        screen_phases = {}
+        for cluster in self.turbulence_clusters:
+            if len(cluster) > 1:
+                screen_phases.update(zip(cluster, np.moveaxis(self.screen_turbulence_phases(cluster, time_in_secs, beta, nreal), 1, 0)))
 
         for ant in np.arange(self.Nant):
-            structD = np.power((time_in_secs/self.coherence_time[ant]), beta) # compute structure function
-            autocorrC = np.abs(0.5*(structD[-1]-structD)) # compute autocorrelation function, clipped at largest mode
-            covmatS = autocorrC[np.abs(x-y)] # compute covariance matrix
-            L = np.linalg.cholesky(covmatS) # Cholesky factorise the covariance matrix
-            
+            if ant in screen_phases:
+                turb_phase = screen_phases[ant]
+            elif self.turbulence_method == 'fft' and nscans > 1:
+                spectrum_func = lambda n: self.turbulence_factor(self.coherence_time[ant], beta, nsamples=n)
+                turb_phase = turbulent_phase_scans(time_in_secs, self.tint, self.coherence_time[ant], self.rng_atm, beta, spectrum_func, nreal)
+            elif self.turbulence_method == 'fft':
+                spectrum = self.turbulence_factor(self.coherence_time[ant], beta, nsamples=nsamples)
+                turb_phase = turbulent_phase_fft(nsamples, self.tint, self.coherence_time[ant], self.rng_atm, beta, spectrum, nreal)[grid_index]
+            else:
+                factor = self.turbulence_factor(self.coherence_time[ant], beta, time_in_secs=time_in_secs)
+                turb_phase = turbulent_phase_cholesky(time_in_secs, self.coherence_time[ant], self.rng_atm, beta, factor, nreal)
+            if nreal:
+                turb_phase_ensemble[:, :, ant] = (np.sqrt(1/np.sin(self.elevation_tropshape[:, 0, ant]))[:, np.newaxis] * (turb_phase[:, 1:] - turb_phase[:, :1])).T
+                turb_phase = turb_phase[:, 0]
+
             # INI: generate random walk error term
-            turb_phase_errors[:, 0, ant] = np.sqrt(1/np.sin(self.elevation_tropshape[:, 0, ant])) * L.dot(self.rng_atm.standard_normal(self.time_unique.shape[0]))
+            turb_phase_errors[:, 0, ant] = np.sqrt(1/np.sin(self.elevation_tropshape[:, 0, ant])) * turb_phase
             turb_phase_errors[:, :, ant] = np.multiply(turb_phase_errors[:, 0, ant].reshape((self.time_unique.shape[0], 1)), (self.chan_freq/self.chan_freq[0]).reshape((1, self.chan_freq.shape[0])))
 
         self.turb_phase_errors = turb_phase_errors
         np.save(II('$OUTDIR')+'/turbulent_phase_errors_timestamp_%d'%(self.timestamp), turb_phase_errors)
+        if nreal:
+            self.turb_phase_ensemble = turb_phase_ensemble
+            np.save(II('$OUTDIR')+'/turbulent_phase_ensemble_timestamp_%d'%(self.timestamp), turb_phase_ensemble)
+
+    def station_clusters(self, radius):
+        """
+        Group the stations into clusters of co-located stations, i.e. the connected components of the graph in which
+        stations closer than radius are linked.
+
+        Parameters
+        ----------
+        radius : float
+            Maximum distance in metres between linked stations. If 0, every station is a cluster of its own.
+
+        Returns
+        -------
+        list of list
+            Station indices of every cluster, ordered by their first station.
+        """
+        label = np.arange(self.Nant)
+        distance = np.linalg.norm(self.pos[:, np.newaxis, :] - self.pos[np.newaxis, :, :], axis=-1)
+        for a0, a1 in zip(*np.nonzero(np.triu(distance < radius, 1))):
+            label[label == label[a1]] = label[a0]
+        return [list(np.flatnonzero(label == l)) for l in np.unique(label)]
+
+    def wind_frame_offsets(self, cluster):
+        """
+        Positions of the stations of a cluster in the wind frame, relative to the first station of the cluster: the
+        distance along the wind direction and across it, in the local horizontal plane of the first station.
+
+        Parameters
+        ----------
+        cluster : list
+            Station indices.
+
+        Returns
+        -------
+        ndarray
+            Along-wind and cross-wind positions in metres, of shape (len(cluster), 2).
+        """
+        x, y, z = self.pos[cluster[0]]
+        lon, lat = np.arctan2(y, x), np.arctan2(z, np.hypot(x, y))
+        dx, dy, dz = (self.pos[cluster] - self.pos[cluster[0]]).T
+        east = -np.sin(lon)*dx + np.cos(lon)*dy
+        north = -np.sin(lat)*np.cos(lon)*dx - np.sin(lat)*np.sin(lon)*dy + np.cos(lat)*dz
+        along = np.sin(self.wind_direction)*east + np.cos(self.wind_direction)*north
+        across = np.cos(self.wind_direction)*east - np.sin(self.wind_direction)*north
+        return np.stack((along, across), axis=-1)
+
+    def screen_turbulence_phases(self, cluster, time_in_secs, beta, nreal=None):
+        """
+        Generate the turbulent phases of a cluster of co-located stations that look through a common 2-D Kolmogorov
+        phase screen, moving with the wind (frozen flow; see turb_funcs.frozen_flow_phases). The Fried parameter of
+        the screen is r0 = wind_speed * coherence_time, with the coherence time averaged over the cluster, so that
+        every station keeps its temporal structure function while the phases of nearby stations are correlated. The
+        phases are generated on a uniform grid spanning the observation and sampled at its timestamps.
+
+        Parameters
+        ----------
+        cluster : list
+            Station indices.
+        time_in_secs : ndarray
+            Timestamps in seconds since the first one.
+        beta : float
+            Power-law index.
+        nreal : int
+            Number of realisations (see turb_funcs.frozen_flow_phases).
+
+        Returns
+        -------
+        ndarray
+            Turbulent phases at zenith of shape (Ntime, len(cluster)), or (Ntime, len(cluster), nreal).
+        """
+        coherence_time = np.mean(self.coherence_time[cluster])
+        if np.ptp(self.coherence_time[cluster]) > 0:
+            warn('Stations %s share a phase screen, but have different coherence times. Using their mean, %.1f s.'%\
+                 (', '.join(self.station_names[ant] for ant in cluster), coherence_time))
+        # INI: the first station sees the screen at time t; a station downwind by d sees it at t - d/wind_speed, i.e. its
+        # along-wind screen coordinate (see turb_funcs.frozen_flow_factor) is -d/wind_speed
+        offsets = self.wind_frame_offsets(cluster) / self.wind_speed
+        offsets[:, 0] *= -1
+        grid_index = np.rint(time_in_secs / self.tint).astype(int)
+        return frozen_flow_phases(grid_index[-1]+1, self.tint, coherence_time, offsets, self.rng_atm, beta, nreal=nreal)[grid_index]
+
+    def write_turbulence_ensemble(self):
+        """
+        Write the additional realisations of the turbulence (see trop_generate_turbulence_phase_errors) to the columns
+        <output_column>_TURB1, <output_column>_TURB2, etc., which are added to the MS if necessary. Since the turbulent
+        phase is an antenna-based scalar, it commutes with all other Jones terms, so every realisation is obtained from
+        the corrupted data in the output column by applying its phase relative to the first realisation. All
+        deterministic work is thus shared. The noise added after the last antenna-based Jones term (trailing_noise_terms;
+        all of the noise when it is added last) is regenerated and replaced by an independent realisation for every
+        column, drawn with its own noise keys. Noise added before later corruptions (e.g. the sky noise of
+        readms_runmeqs, which precedes the turbulent phases) is shared between the columns. Only active rows are written.
+
+        Must be called after all corruptions and noise have been added, and before flush_jones_chain.
+        """
+        if self.turb_phase_ensemble is None:
+            return
+        columns = ['%s_TURB%d'%(self.output_column, k+1) for k in range(self.turb_phase_ensemble.shape[0])]
+        info('Writing %d additional realisations of the turbulence to columns %s'%(len(columns), ', '.join(columns)))
+
+        tab = pt.table(self.msname, readonly=False, ack=False)
+        for column in columns:
+            if column not in tab.colnames():
+                tab.addcols(pt.makearrcoldesc(column, value=0j, shape=[self.num_chan, 4], valuetype='complex'))
+        tab.close()
+
+        turb_phase_ensemble = self.turb_phase_ensemble
+        freq_ratio = self.chan_freq/self.chan_freq[0]
+        noise_terms = list(self.trailing_noise_terms)
+
+        def write_ensemble_rows(tab, data, block, rows):
+            tind = self.time_index[rows]
+            # INI: the phasors of all antennas are computed for the timestamps spanned by the chunk and gathered to rows
+            tmin, tmax = tind.min(), tind.max()
+            signal = data - self.realise_noise_terms(noise_terms, rows)[0] # INI: the data without the noise of the output column
+            for k, column in enumerate(columns):
+                phasors = np.exp(1j * turb_phase_ensemble[k, tmin:tmax+1, np.newaxis, :] * freq_ratio[:, np.newaxis])
+                member = signal.copy()
+                self.apply_cross_rows(lambda vis, cross_rows: apply_jones(vis, phasors[self.time_index[cross_rows]-tmin, :, self.A0[cross_rows]],
+                                      phasors[self.time_index[cross_rows]-tmin, :, self.A1[cross_rows]], 'scalar'), member, rows)
+                member += self.realise_noise_terms(noise_terms, rows, realisation=k+1)[0]
+                tab.putcol(column, member, startrow=block.start, nrow=block.stop-block.start)
+
+        self.apply_jones_chain() # realisations are derived from the fully corrupted data
+        if self.streaming:
+            self.stream_ops.append(write_ensemble_rows)
+            return
+
+        tab = pt.table(self.msname, readonly=False, ack=False)
+        active_tab = self.active_table(tab)
+        for block, rows in self.active_chunks():
+            write_ensemble_rows(active_tab, self.data[rows], block, rows)
+        tab.close()
+        self.close_noise_pool()
+
+    def turbulence_factor(self, coherence_time, beta, nsamples=None, time_in_secs=None):
+        """
+        Return the factor of the covariance of the turbulent phase for the current turbulence_method, i.e. the
+        spectrum of its circulant embedding ('fft') or its Cholesky factor ('cholesky'). Factors are cached in memory
+        by (method, coherence time, time grid), so that antennas with the same coherence time share one factor, and
+        on disk if cache_dir is set, so that later runs on the same schedule reuse it.
+
+        Parameters
+        ----------
+        coherence_time : float
+            Coherence time in seconds.
+        beta : float
+            Power-law index of the structure function.
+        nsamples : int
+            Number of samples of the uniform grid with the integration time as sampling interval ('fft').
+        time_in_secs : ndarray
+            Times in seconds since the first timestamp ('cholesky').
+
+        Returns
+        -------
+        ndarray
+            The covariance factor.
+        """
+        if self.turbulence_method == 'fft':
+            grid = np.array([nsamples, self.tint], dtype=float)
+        else:
+            grid = time_in_secs
+        key = array_digest(np.frombuffer(self.turbulence_method.encode(), dtype=np.uint8), np.array([coherence_time, beta], dtype=float), grid)
+        if key in self.turb_factors:
+            return self.turb_factors[key]
+
+        cached = load_cached(self.turb_cache_dir, key, ['factor']) if self.turb_cache_dir else None
+        if cached is not None:
+            factor = cached['factor']
+        else:
+            if self.turbulence_method == 'fft':
+                factor = increment_spectrum(nsamples, self.tint, coherence_time, beta)
+            else:
+                factor = cholesky_factor(time_in_secs, coherence_time, beta)
+            if self.turb_cache_dir and factor.nbytes > self.turb_cache_size:
+                info('Turbulence covariance factor (%.1f MB) exceeds turbulence_cache_size; it is not cached on disk.'%(factor.nbytes/1024.**2))
+            elif self.turb_cache_dir:
+                save_cached(self.turb_cache_dir, key, {'factor': factor})
+                evict_lru(self.turb_cache_dir, self.turb_cache_size, keep=[key])
+        self.turb_factors[key] = factor
+        return factor
 
     def trop_calc_fixdelay_phase_offsets(self):
         """insert constant delay for each station for all time stamps. 
@@ -665,7 +1289,10 @@ class SimCoordinator():
     
     def trop_ATM_dispersion(self):
         """
-        Calculates extra path length due to mean wet and dry troposphere per frequency channel.
+        Calculates extra path length due to mean wet and dry troposphere per frequency channel, using AATM or by
+        interpolating the atmosphere grid, if given.
+        The AATM program is run concurrently, once for every unique set of station weather parameters, unless its
+        output is in the AATM cache (see run_aatm).
 
         Returns
         -------
@@ -674,27 +1301,28 @@ class SimCoordinator():
         """
         extra_path_length = np.zeros((self.chan_freq.shape[0], self.Nant))
 
-        for ant in range(self.Nant):
+        if self.atm_grid is not None:
+            info('Interpolating tropospheric path lengths from the atmosphere grid...')
+            extra_path_length = self.atm_grid_spectra('wet_disp') + self.atm_grid_spectra('wet_non_disp')
+            if not self.trop_wetonly:
+                extra_path_length += self.atm_grid_spectra('dry_non_disp')
+            for ant in range(self.Nant):
+                np.save(II('$OUTDIR')+'/atm_output/delay_norm_ant%i_timestamp_%d'%(ant, self.timestamp), extra_path_length[:,ant] / speed_of_light)
+            np.save(II('$OUTDIR')+'/atm_output/delay_norm_timestamp_%d'%(self.timestamp), extra_path_length / speed_of_light)
+            return extra_path_length
 
-            fmin,fmax,fstep = (self.chan_freq[0]-(self.chan_width)) / 1e9,\
-                              (self.chan_freq[-1]) / 1e9, \
-                              self.chan_width/1e9 # note that fmin output != self.chan_freq
-            ATM_disp_string = 'dispersive --fmin %f --fmax %f --fstep %f --pwv %f --gpress %f --gtemp %f' %\
-                             (fmin, fmax, fstep, self.average_pwv[ant], \
-                              self.average_gpress[ant],self.average_gtemp[ant])
-            
-            output = subprocess.check_output(ATM_disp_string,shell=True)
+        commands = self.aatm_commands('dispersive')
+        outputs = run_aatm(commands, self.aatm_workers, self.aatm_cache_dir, self.aatm_cache_size)
+
+        for ant in range(self.Nant):
             atmfile = open(II('$OUTDIR')+'/atm_output/ATMstring_ant%i.txt'%ant,'a')
-            print(ATM_disp_string, file=atmfile)
+            print(commands[ant], file=atmfile)
             atmfile.close()
 
             with open(II('$OUTDIR')+'/atm_output/%satm_disp.txt'%ant, 'wb') as atm_disp:
-                atm_disp.write(output)
+                atm_disp.write(outputs[commands[ant]])
 
-            if self.num_chan == 1:
-                wet_non_disp, wet_disp, dry_non_disp = np.swapaxes(np.expand_dims(np.genfromtxt(II('$OUTDIR')+'/atm_output/%satm_disp.txt'%ant, skip_header=1, usecols=[1, 2, 3], delimiter=',',autostrip=True), axis=0), 0, 1)
-            else:
-                wet_non_disp, wet_disp, dry_non_disp = np.swapaxes(np.genfromtxt(II('$OUTDIR')+'/atm_output/%satm_disp.txt'%ant, skip_header=1, usecols=[1, 2, 3], delimiter=',',autostrip=True), 0, 1)
+            wet_non_disp, wet_disp, dry_non_disp = parse_aatm_output(outputs[commands[ant]], [1, 2, 3]).T
             if (self.trop_wetonly):
                 extra_path_length[:, ant] = wet_disp + wet_non_disp
             else:
@@ -738,15 +1366,7 @@ class SimCoordinator():
         if normalise:
             errors += self.phase_normalisation()
 
-        for a0 in range(self.Nant):
-            for a1 in range(self.Nant):
-                if a1 > a0:
-                    # the following line was errors[:,:,a1] - errors[:,:,a0], 
-                    # swopped it around to get right delay signs from AIPS
-                    error_column = np.exp(1j * (errors[:, :, a0] - errors[:, :, a1]))
-                    self.data[self.baseline_dict[(a0, a1)]] = np.multiply(self.data[self.baseline_dict[(a0, a1)]],
-                                                                          np.expand_dims(error_column, 2))
-        self.save_data()
+        self.apply_phase_errors(errors)
         info('Kolmogorov turbulence-induced phase fluctuations applied')
 
 
@@ -759,17 +1379,11 @@ class SimCoordinator():
         combined_phase_errors : ndarray
             The array containing the combined phase errors.
         """
-        for a0 in range(self.Nant):
-            for a1 in range(self.Nant):
-                if a1 > a0:
-                    # the following line was errors[:,:,a1] - errors[:,:,a0],
-                    # swopped it around to get right delay signs from AIPS
-                    error_column = np.exp(1j * (combined_phase_errors[:, :, a0] \
-                                            - combined_phase_errors[:, :,a1]))
-                    self.data[self.baseline_dict[(a0, a1)]] = \
-                        np.multiply(self.data[self.baseline_dict[(a0, a1)]],\
-                        np.expand_dims(error_column, 2))
-        self.save_data()
+        # the baseline phase is errors[:,:,a0] - errors[:,:,a1] (not a1 - a0) to get right delay signs from AIPS
+        # INI: the phasors are computed once per antenna on the (Ntime, Nchan, Nant) grid and gathered to the rows of both
+        # antennas, so that the baseline terms need a complex multiplication instead of two exponentials per row
+        phasors = np.exp(1j * combined_phase_errors)
+        self.apply_antenna_jones(lambda tind, ant: phasors[tind, :, ant])
 
         
     def trop_plots(self):
@@ -812,7 +1426,7 @@ class SimCoordinator():
         if self.transmission_matrix is not None:
           pl.figure() #figsize=(10,6.8))
           for i in range(self.Nant):
-            pl.imshow(self.transmission_matrix[:,:,i,0],origin='lower',aspect='auto',\
+            pl.imshow(self.transmission_matrix[:,:,i],origin='lower',aspect='auto',\
                       extent=[(self.chan_freq[0]-(self.chan_width/2.))/1e9,(self.chan_freq[-1]+(self.chan_width/2.))/1e9,0,self.obslength/3600.])
             pl.xlabel('Frequency / GHz', fontsize=16)
             pl.ylabel('Relative time / hr', fontsize=16)
@@ -920,70 +1534,107 @@ class SimCoordinator():
             Changes the pointing error for each antenna every pointing_timescale
             which one of could essentially think of as a scan length (e.g. 10 minutes).
             """
-            self.PB_FWHM = PB_FWHM230 / (self.chan_freq.mean() / 230e9) # convert 230 GHz PB to current obs frequency
+            self.PB_FWHM = np.outer(PB_FWHM230, 230e9 / self.chan_freq) # convert 230 GHz PB to every channel frequency (Nant, Nchan)
             self.num_mispoint_epochs = max(1, int(round(self.obslength / (pointing_timescale * 60.), 0))) # could be number of scans, for example
             self.mjd_per_ptg_epoch = (self.mjd_obs_end - self.mjd_obs_start) / self.num_mispoint_epochs
-            self.mjd_ptg_epoch_timecentroid = np.arange(self.mjd_obs_start,self.mjd_obs_end,
-                                                        self.mjd_per_ptg_epoch) + (self.mjd_per_ptg_epoch/2.)
-            # handle potential rounding error
-            if self.num_mispoint_epochs != len(self.mjd_ptg_epoch_timecentroid):
-                self.mjd_ptg_epoch_timecentroid = self.mjd_ptg_epoch_timecentroid[:-1]
+            self.mjd_ptg_epoch_timecentroid = self.mjd_obs_start + self.mjd_per_ptg_epoch * (np.arange(self.num_mispoint_epochs) + 0.5)
+            self.pointing_times = self.mjd_ptg_epoch_timecentroid
+            # INI: pointing epoch of every unique timestamp, computed once
+            epoch_edges = self.mjd_obs_start + self.mjd_per_ptg_epoch * np.arange(1, self.num_mispoint_epochs)
+            self.pointing_epoch_index = np.searchsorted(epoch_edges, self.time_unique, side='right')
 
             self.pointing_offsets = pointing_rms.reshape(self.Nant,1) * self.rng_predict.standard_normal((self.Nant,self.num_mispoint_epochs)) # units: arcsec
-            for ant in range(self.Nant):
-                ind = (self.mjd_ptg_epoch_timecentroid < self.mjd_ant_rise[ant]) \
-                    | (self.mjd_ptg_epoch_timecentroid > self.mjd_ant_set[ant])
-
-                self.pointing_offsets[ant,ind] = np.nan # this masks out pointing offsets for stowed antennas
+            stowed = (self.mjd_ptg_epoch_timecentroid[np.newaxis, :] < self.mjd_ant_rise[:, np.newaxis]) \
+                | (self.mjd_ptg_epoch_timecentroid[np.newaxis, :] > self.mjd_ant_set[:, np.newaxis])
+            self.pointing_offsets[stowed] = np.nan # this masks out pointing offsets for stowed antennas
 
             PB_model = ['gaussian']*self.Nant # primary beam model set in input config file. Hardwired to Gaussian for now. 
 
-            amp_errors = np.zeros([self.Nant,self.num_mispoint_epochs])
+            # INI: primary beam gain of every antenna, pointing epoch and channel (Nant, Nepoch, Nchan)
+            amp_errors = np.zeros([self.Nant,self.num_mispoint_epochs,self.chan_freq.shape[0]])
             for ant in range(self.Nant):
                 if PB_model[ant] == 'cosine3':
-                    amp_errors[ant,:] = np.cos(self.pointing_offsets[ant,:]/206265.)**3 #placeholder, incorrect
+                    amp_errors[ant] = (np.cos(self.pointing_offsets[ant,:]/206265.)**3)[:, np.newaxis] #placeholder, incorrect
 
                 elif PB_model[ant] == 'gaussian':
-                    amp_errors[ant,:] = np.exp(-0.5*(self.pointing_offsets[ant,:]/(self.PB_FWHM[ant]/2.35))**2) 
+                    amp_errors[ant] = gaussian_beam_gain(self.pointing_offsets[ant,:,np.newaxis], self.PB_FWHM[ant,np.newaxis,:])
 
                     
             self.pointing_amp_errors = amp_errors
 
 
+    def pointing_continuous_offset(self, pointing_rms, PB_FWHM230, drift_rms, drift_timescale):
+            """
+            Compute pointing offsets that vary continuously in time: a constant offset per scan plus a drift.
+
+            Parameters
+            ----------
+            pointing_rms : ndarray
+                The rms of the offset of every scan for each antenna.
+            PB_FWHM230 : ndarray
+                The primary beam FWHM at 230 GHz for each antenna.
+            drift_rms : float
+                The rms of the pointing drift (arcsec).
+            drift_timescale : float
+                The correlation time of the pointing drift (seconds), e.g. 1-10 s for jitter.
+
+            Notes
+            -----
+            A new offset is drawn for each antenna at the start of every scan, i.e. at every change of SCAN_NUMBER
+            and after every gap in time. The drift is an Ornstein-Uhlenbeck process per antenna (see
+            pointing_funcs.ou_process). The offsets are evaluated once on the unique timestamps; the primary beam
+            gains are computed from them for every chunk of rows in apply_pointing_amp_error.
+            """
+            self.PB_FWHM = np.outer(PB_FWHM230, 230e9 / self.chan_freq) # convert 230 GHz PB to every channel frequency (Nant, Nchan)
+            tab = pt.table(self.msname, ack=False)
+            scan_number = np.zeros(self.time_unique.shape[0], dtype=int)
+            scan_number[self.time_index] = tab.getcol('SCAN_NUMBER')
+            tab.close()
+            new_scan = np.ones(self.time_unique.shape[0], dtype=bool)
+            new_scan[1:] = (np.diff(scan_number) != 0) | (np.diff(self.time_unique) > 1.5*self.tint)
+            scan_index = np.cumsum(new_scan) - 1
+
+            scan_offsets = pointing_rms.reshape(self.Nant,1) * self.rng_predict.standard_normal((self.Nant,scan_index[-1]+1)) # units: arcsec
+            drift = ou_process(self.time_unique - self.time_unique[0], drift_timescale, drift_rms, self.rng_predict, self.Nant)
+            self.pointing_offsets = scan_offsets[:, scan_index] + drift
+            stowed = (self.time_unique[np.newaxis, :] < self.mjd_ant_rise[:, np.newaxis]) \
+                | (self.time_unique[np.newaxis, :] > self.mjd_ant_set[:, np.newaxis])
+            self.pointing_offsets[stowed] = np.nan # this masks out pointing offsets for stowed antennas
+            self.pointing_times = self.time_unique
+            self.pointing_amp_errors = None # INI: the gains are evaluated per chunk of rows instead of being tabulated
+
+
     def apply_pointing_amp_error(self):
             """
-            Apply pointing amplitude errors to data and save.
+            Apply pointing amplitude errors to data and save. The gain of every row is looked up in the table of primary
+            beam gains per antenna, pointing epoch and channel (pointing_constant_offset), or computed from the pointing
+            offset at its timestamp (pointing_continuous_offset), and applied to all polarisations.
             """
-            for a0 in range(self.Nant):
-                for a1 in range(self.Nant):
-                    if a1 > a0:
-                        bl_indices = self.baseline_dict[(a0,a1)] # baseline indices only, all times
-                        for mispoint_epoch in range(self.num_mispoint_epochs):
-                            epoch_ind_mask = (self.time[bl_indices] >= ( self.mjd_obs_start + (mispoint_epoch*self.mjd_per_ptg_epoch))) &\
-                                       (self.time[bl_indices] <= ( self.mjd_obs_start + (mispoint_epoch+1)*self.mjd_per_ptg_epoch))
-                                        
-                                         # need to add a elevation mask 
-                            bl_epoch_indices = bl_indices[epoch_ind_mask]
-                            
-                                        
-            
-                            self.data[bl_epoch_indices,:,:] *= (self.pointing_amp_errors[a0,mispoint_epoch] \
-                                                                * self.pointing_amp_errors[a1,mispoint_epoch])
-                        #### NOTE: this applies to all pols, all frequency channels (i.e. no primary beam freq dependence)
-                        #self.data[indices,0,3] *= (self.point_amp_errors[a0] * self.point_amp_errors[a1])
-            self.save_data()
+            if self.pointing_amp_errors is None:
+                offsets, fwhm = self.pointing_offsets, self.PB_FWHM
+                self.apply_antenna_jones(lambda tind, ant: gaussian_beam_gain(offsets[ant, tind][:, np.newaxis], fwhm[ant]))
+                return
+            epoch_index = self.pointing_epoch_index
+            amp_errors = self.pointing_amp_errors
+            self.apply_antenna_jones(lambda tind, ant: amp_errors[ant, epoch_index[tind]])
 
 
     def plot_pointing_errors(self):
         """
-        Generate pointing error plots.
+        Generate pointing error plots. The primary beam gains are shown at the central channel.
         """
+        mid_chan = self.chan_freq.shape[0] // 2
+        if self.pointing_amp_errors is None:
+            amp_errors = gaussian_beam_gain(self.pointing_offsets, self.PB_FWHM[:, mid_chan, np.newaxis])
+        else:
+            amp_errors = self.pointing_amp_errors[:, :, mid_chan]
+        rel_time = (self.pointing_times - self.mjd_obs_start) / 3600.
 
         ### plot antenna offset vs pointing epoch
         pl.figure(figsize=(10,6.8))
         #color.cycle_cmap(self.Nant, cmap=cmap) # INI: deprecated
         for i in range(self.Nant):
-            pl.plot(np.linspace(0,self.obslength/3600,self.num_mispoint_epochs),self.pointing_offsets[i,:],alpha=1,label=self.station_names[i])
+            pl.plot(rel_time,self.pointing_offsets[i,:],alpha=1,label=self.station_names[i])
         pl.xlabel('Relative time / hr', fontsize=FSIZE)
         pl.ylabel('Pointing offset / arcsec', fontsize=FSIZE) 
         lgd = pl.legend(bbox_to_anchor=(1.02,1),loc=2,shadow=True)
@@ -995,8 +1646,8 @@ class SimCoordinator():
         pl.figure(figsize=(10,6.8))
         #color.cycle_cmap(self.Nant, cmap=cmap) # INI: deprecated
         for i in range(self.Nant):
-            pl.plot(np.linspace(0,self.obslength/3600,self.num_mispoint_epochs),self.pointing_amp_errors[i,:],alpha=1,label=self.station_names[i])
-        pl.ylim(np.nanmin(self.pointing_amp_errors[:, :]) * 0.9, 1.04)
+            pl.plot(rel_time,amp_errors[i,:],alpha=1,label=self.station_names[i])
+        pl.ylim(np.nanmin(amp_errors) * 0.9, 1.04)
         pl.xlabel('Relative time / hr', fontsize=FSIZE)
         pl.ylabel('Primary beam response', fontsize=FSIZE)        
         lgd = pl.legend(bbox_to_anchor=(1.02,1),loc=2,shadow=True)
@@ -1009,9 +1660,9 @@ class SimCoordinator():
         #color.cycle_cmap(self.Nant, cmap=cmap) # INI: deprecated
         marker = itertools.cycle(('.', 'o', 'v', '^', 's', '+', '*', 'h', 'D'))
         for i in range(self.Nant):
-            pl.plot(abs(self.pointing_offsets[i,:]),self.pointing_amp_errors[i,:], marker=next(marker), linestyle='', alpha=1,label=self.station_names[i])
+            pl.plot(abs(self.pointing_offsets[i,:]),amp_errors[i,:], marker=next(marker), linestyle='', alpha=1,label=self.station_names[i])
         pl.xlim(0,np.nanmax(abs(self.pointing_offsets))*1.1)
-        pl.ylim(np.nanmin(self.pointing_amp_errors[i,:])*0.8,1.04)
+        pl.ylim(np.nanmin(amp_errors[i,:])*0.8,1.04)
         pl.xlabel(r'Pointing offset, $\rho$ / arcsec', fontsize=FSIZE)
         pl.ylabel('Primary beam response', fontsize=FSIZE) #antenna pointing amplitude error')
         pl.xticks(fontsize=20)
@@ -1049,7 +1700,7 @@ class SimCoordinator():
         if self.bpass_input_freq[0] > self.chan_freq[0] or self.bpass_input_freq[-1] < self.chan_freq[-1]:
             warn("Input frequencies out of range of MS frequencies. Extrapolating in some places.")
 
-        self.bjones_interpolated=np.zeros((self.Nant,self.chan_freq.shape[0],2,2), dtype=complex)
+        self.bjones_interpolated=np.zeros((self.Nant,self.chan_freq.shape[0],2), dtype=complex) # diagonal B-Jones terms
         for ant in range(self.Nant):
             spl_r = ius(self.bpass_input_freq, self.bjones_ampl_r[ant], k=self.bandpass_freq_interp_order)
             spl_l = ius(self.bpass_input_freq, self.bjones_ampl_l[ant], k=self.bandpass_freq_interp_order)
@@ -1058,21 +1709,15 @@ class SimCoordinator():
             temp_amplitudes_l = spl_l(self.chan_freq)
             temp_phases_r = np.deg2rad(60*self.rng_predict.random(temp_amplitudes_r.shape[0]) - 30) # add random phases between -30 deg to +30 deg
             temp_phases_l = np.deg2rad(60*self.rng_predict.random(temp_amplitudes_l.shape[0]) - 30) # add random phases between -30 deg to +30 deg
-            self.bjones_interpolated[ant,:,0,0] = np.array(list(map(cmath.rect, temp_amplitudes_r, temp_phases_r)))
-            self.bjones_interpolated[ant,:,1,1] = np.array(list(map(cmath.rect, temp_amplitudes_l, temp_phases_l)))
-
-        # INI: Write the bandpass gains
-        np.save(II('$OUTDIR')+'/bterms_timestamp_%d'%(self.timestamp), self.bjones_interpolated)
-
-        # apply the B-Jones terms by iterating over baselines
-        data_reshaped = self.data.reshape((self.data.shape[0],self.data.shape[1],2,2))
-        for a0 in range(self.Nant):
-            for a1 in range(a0+1,self.Nant):
-                bl_ind = self.baseline_dict[(a0,a1)]
-                for freq_ind in range(self.chan_freq.shape[0]):
-                    data_reshaped[bl_ind,freq_ind] = np.matmul(np.matmul(self.bjones_interpolated[a0,freq_ind], data_reshaped[bl_ind,freq_ind]), np.conjugate(self.bjones_interpolated[a1,freq_ind].T))
-        self.data = data_reshaped.reshape(self.data.shape)
-        self.save_data()
+            self.bjones_interpolated[ant,:,0] = np.array(list(map(cmath.rect, temp_amplitudes_r, temp_phases_r)))
+            self.bjones_interpolated[ant,:,1] = np.array(list(map(cmath.rect, temp_amplitudes_l, temp_phases_l)))
+
+        # INI: Write the bandpass gains (as full 2x2 matrices)
+        np.save(II('$OUTDIR')+'/bterms_timestamp_%d'%(self.timestamp), diag_to_full(self.bjones_interpolated))
+
+        # apply the B-Jones terms to all baselines
+        bjones = self.bjones_interpolated
+        self.apply_antenna_jones(lambda tind, ant: bjones[ant], kind='diag')
 
 
     def make_bandpass_plots(self):
@@ -1082,8 +1727,8 @@ class SimCoordinator():
         fig, ax1 = pl.subplots()
         #color.cycle_cmap(self.Nant, cmap=cmap) # INI: deprecated
         for i in range(self.Nant):
-            ax1.plot(self.chan_freq/1e9,np.abs(self.bjones_interpolated[i,:,0,0]),label=self.station_names[i])
-            #ax1.plot(self.chan_freq,np.abs(self.bjones_interpolated[i,:,0,0]),label=self.station_names[i])
+            ax1.plot(self.chan_freq/1e9,np.abs(self.bjones_interpolated[i,:,0]),label=self.station_names[i])
+            #ax1.plot(self.chan_freq,np.abs(self.bjones_interpolated[i,:,0]),label=self.station_names[i])
         ax1.set_xlabel('Frequency / GHz', fontsize=18) # was FSIZE
         ax1.set_ylabel('Gain amplitude', fontsize=18)
         ax1.tick_params(axis="x", labelsize=18) # was 18
@@ -1099,8 +1744,8 @@ class SimCoordinator():
 
         fig, ax1 = pl.subplots()
         for i in range(self.Nant):
-            ax1.plot(self.chan_freq/1e9,np.abs(self.bjones_interpolated[i,:,1,1]),label=self.station_names[i])
-            #ax1.plot(self.chan_freq,np.abs(self.bjones_interpolated[i,:,1,1]),label=self.station_names[i])
+            ax1.plot(self.chan_freq/1e9,np.abs(self.bjones_interpolated[i,:,1]),label=self.station_names[i])
+            #ax1.plot(self.chan_freq,np.abs(self.bjones_interpolated[i,:,1]),label=self.station_names[i])
         ax1.set_xlabel('Frequency / GHz', fontsize=18) # was FSIZE
         ax1.set_ylabel('Gain amplitude', fontsize=18) # was FSIZE
         ax1.tick_params(axis="x", labelsize=18) # was 18
@@ -1123,91 +1768,55 @@ class SimCoordinator():
       Add constant-in-time station-based polarization leakage (D-Jones term) that varies with frequency to data.
       These can be generated in either antenna frame or sky frame.
       """
+      self.djones_mat = np.ones((self.Nant,self.num_chan,2,2),dtype=complex)
+      for ant in range(self.Nant):
+        self.djones_mat[ant,:,0,1] = self.rng_predict.normal(self.dR_mean.real[ant],self.dR_std.real[ant],size=(self.num_chan)) + 1j*self.rng_predict.normal(self.dR_mean.imag[ant],self.dR_std.imag[ant],size=(self.num_chan))
+        self.djones_mat[ant,:,1,0] = self.rng_predict.normal(self.dL_mean.real[ant],self.dL_std.real[ant],size=(self.num_chan)) + 1j*self.rng_predict.normal(self.dL_mean.imag[ant],self.dL_std.imag[ant],size=(self.num_chan))
+
+      # Compute P-Jones matrices, Rot(theta = feed_angle + parallactic_angle +/- elevation). Notation following Dodson 2005, 2007.
+      self.pjones_mat = np.zeros((self.Nant,self.time_unique.shape[0],2),dtype=complex) # diagonal P-Jones terms
+      for ant in range(self.Nant):
+        if self.mount[ant] == 'ALT-AZ':
+          field_angle = self.feed_angle[ant]+self.parallactic_angle[ant,:]
+        elif self.mount[ant] == 'ALT-AZ+NASMYTH-L':
+          field_angle = self.feed_angle[ant]+self.parallactic_angle[ant,:]-self.elevation_copy_dterms[ant,:]
+        elif self.mount[ant] == 'ALT-AZ+NASMYTH-R':
+          field_angle = self.feed_angle[ant]+self.parallactic_angle[ant,:]+self.elevation_copy_dterms[ant,:]
+        else:
+          abort("Unknown mount type '%s' for station %s."%(self.mount[ant], self.station_names[ant]))
+        self.pjones_mat[ant,:,0] = np.exp(-1j*field_angle) # INI: opposite of feed angle i.e. parang +/- elev
+        self.pjones_mat[ant,:,1] = np.exp(1j*field_angle)
+
+      djones_mat = self.djones_mat
+      pjones_mat = self.pjones_mat
 
       if self.parang_corrected == False:
         # INI: Do not remove parallactic angle rotation effect (vis in antenna plane). Hence, perform 2*field_angle rotation (Leppanen, 1995)
         info("Applying D-terms without correcting for parang rotation. Visibilities are in the antenna plane.")
-        # Compute P-Jones matrices
-        self.pjones_mat = np.zeros((self.Nant,self.time_unique.shape[0],2,2),dtype=complex)
-        self.djones_mat = np.ones((self.Nant,self.num_chan,2,2),dtype=complex)
 
-        for ant in range(self.Nant):
-          self.djones_mat[ant,:,0,1] = self.rng_predict.normal(self.dR_mean.real[ant],self.dR_std.real[ant],size=(self.num_chan)) + 1j*self.rng_predict.normal(self.dR_mean.imag[ant],self.dR_std.imag[ant],size=(self.num_chan))
-          self.djones_mat[ant,:,1,0] = self.rng_predict.normal(self.dL_mean.real[ant],self.dL_std.real[ant],size=(self.num_chan)) + 1j*self.rng_predict.normal(self.dL_mean.imag[ant],self.dL_std.imag[ant],size=(self.num_chan))
-
-          if self.mount[ant] == 'ALT-AZ':
-            self.pjones_mat[ant,:,0,0] = np.exp(-1j*(self.feed_angle[ant]+self.parallactic_angle[ant,:])) # INI: opposite of feed angle i.e. parang +/- elev
-            self.pjones_mat[ant,:,1,1] = np.exp(1j*(self.feed_angle[ant]+self.parallactic_angle[ant,:]))
-          elif self.mount[ant] == 'ALT-AZ+NASMYTH-L':
-            self.pjones_mat[ant,:,0,0] = np.exp(-1j*(self.feed_angle[ant]+self.parallactic_angle[ant,:]-self.elevation_copy_dterms[ant,:]))
-            self.pjones_mat[ant,:,1,1] = np.exp(1j*(self.feed_angle[ant]+self.parallactic_angle[ant,:]-self.elevation_copy_dterms[ant,:]))
-          elif self.mount[ant] == 'ALT-AZ+NASMYTH-R':
-            self.pjones_mat[ant,:,0,0] = np.exp(-1j*(self.feed_angle[ant]+self.parallactic_angle[ant,:]+self.elevation_copy_dterms[ant,:]))
-            self.pjones_mat[ant,:,1,1] = np.exp(1j*(self.feed_angle[ant]+self.parallactic_angle[ant,:]+self.elevation_copy_dterms[ant,:]))
-          
-        data_reshaped = self.data.reshape((self.data.shape[0],self.data.shape[1],2,2))
-
-        for a0 in range(self.Nant):
-            for a1 in range(a0+1,self.Nant):
-                bl_ind = self.baseline_dict[(a0,a1)]
-                for ind in bl_ind:
-                  for freq_ind in range(self.num_chan):
-                    data_reshaped[ind,freq_ind] = np.matmul(self.djones_mat[a0,freq_ind], np.matmul(self.pjones_mat[a0,time_ind], np.matmul(data_reshaped[ind,freq_ind], \
-                                         np.matmul(np.conjugate(self.pjones_mat[a1,time_ind].T), np.conjugate(self.djones_mat[a1,freq_ind].T)))))
-
-        self.data = data_reshaped.reshape(self.data.shape) 
-        self.save_data()
+        def pol_leakage_jones(tind, ant):
+          # D.P for all rows and channels at once; the diagonal P scales the columns of D
+          return djones_mat[ant] * pjones_mat[ant,tind][:,np.newaxis,np.newaxis,:]
 
-        np.save(II('$OUTDIR')+'/pjones_noparangcorr_timestamp_%d'%(self.timestamp), self.pjones_mat)
+        np.save(II('$OUTDIR')+'/pjones_noparangcorr_timestamp_%d'%(self.timestamp), diag_to_full(self.pjones_mat))
         np.save(II('$OUTDIR')+'/djones_noparangcorr_timestamp_%d'%(self.timestamp), self.djones_mat)
 
       elif self.parang_corrected == True:
         # INI: Remove parallactic angle rotation effect (vis in sky plane). Hence, perform 2*field_angle rotation (Leppanen, 1995)
         info("Applying D-terms with parang rotation corrected for. Visibilities are in the sky plane.")
 
-        # Construct station-based leakage matrices (D-Jones)
-        #self.pol_leak_mat = np.zeros((self.Nant,2,2),dtype=complex) # To serve as both D_N and D_C
-        #self.pol_leak_mat = np.zeros((self.Nant,self.time_unique.shape[0],2,2),dtype=complex)
-        self.pol_leak_mat = np.ones((self.Nant,self.time_unique.shape[0],self.num_chan,2,2),dtype=complex)
-        self.djones_mat = np.ones((self.Nant,self.num_chan,2,2),dtype=complex)
+        def pol_leakage_jones(tind, ant):
+          # P^H.D.P rotates the leakage terms by twice the field angle, for all rows and channels at once
+          pjones_rows = pjones_mat[ant,tind][:,np.newaxis]
+          return np.conjugate(pjones_rows)[:,:,:,np.newaxis] * djones_mat[ant] * pjones_rows[:,:,np.newaxis,:]
 
-        for ant in range(self.Nant):
-          self.djones_mat[ant,:,0,1] = self.rng_predict.normal(self.dR_mean.real[ant],self.dR_std.real[ant],size=(self.num_chan)) + 1j*self.rng_predict.normal(self.dR_mean.imag[ant],self.dR_std.imag[ant],size=(self.num_chan))
-          self.djones_mat[ant,:,1,0] = self.rng_predict.normal(self.dL_mean.real[ant],self.dL_std.real[ant],size=(self.num_chan)) + 1j*self.rng_predict.normal(self.dL_mean.imag[ant],self.dL_std.imag[ant],size=(self.num_chan))
-
-        # Set up D = D_N = D_C, Rot(theta = parallactic_angle +/- elevation). Notation following Dodson 2005, 2007.
-        for ant in range(self.Nant):
-          for freq_ind in range(self.num_chan):
-            if self.mount[ant] == 'ALT-AZ':
-                self.pol_leak_mat[ant,:,freq_ind,0,1] = self.djones_mat[ant,freq_ind,0,1] * np.exp(1j*2*(self.feed_angle[ant]+self.parallactic_angle[ant,:]))
-                self.pol_leak_mat[ant,:,freq_ind,1,0] = self.djones_mat[ant,freq_ind,1,0] * np.exp(-1j*2*(self.feed_angle[ant]+self.parallactic_angle[ant,:]))
-
-            elif self.mount[ant] == 'ALT-AZ+NASMYTH-L':
-                self.pol_leak_mat[ant,:,freq_ind,0,1] = self.djones_mat[ant,freq_ind,0,1] * np.exp(1j*2*(self.feed_angle[ant]+self.parallactic_angle[ant,:]-self.elevation_copy_dterms[ant,:]))
-                self.pol_leak_mat[ant,:,freq_ind,1,0] = self.djones_mat[ant,freq_ind,1,0] * np.exp(-1j*2*(self.feed_angle[ant]+self.parallactic_angle[ant,:]-self.elevation_copy_dterms[ant,:]))
-           
-            elif self.mount[ant] == 'ALT-AZ+NASMYTH-R':
-                self.pol_leak_mat[ant,:,freq_ind,0,1] = self.djones_mat[ant,freq_ind,0,1] * np.exp(1j*2*(self.feed_angle[ant]+self.parallactic_angle[ant,:]+self.elevation_copy_dterms[ant,:]))
-                self.pol_leak_mat[ant,:,freq_ind,1,0] = self.djones_mat[ant,freq_ind,1,0] * np.exp(-1j*2*(self.feed_angle[ant]+self.parallactic_angle[ant,:]+self.elevation_copy_dterms[ant,:]))
-
-        # Save to external file as numpy array
-        np.save(II('$OUTDIR')+'/panddjones_parangcorr_timestamp_%d'%(self.timestamp), self.pol_leak_mat)
+        # Save to external file as numpy array: the rotated leakage P^H.D.P of every antenna, time and channel
+        pol_leak_mat = np.conjugate(self.pjones_mat)[:,:,np.newaxis,:,np.newaxis] * djones_mat[:,np.newaxis] * \
+                       self.pjones_mat[:,:,np.newaxis,np.newaxis,:]
+        np.save(II('$OUTDIR')+'/panddjones_parangcorr_timestamp_%d'%(self.timestamp), pol_leak_mat)
         np.save(II('$OUTDIR')+'/dterms_parangcorr_timestamp_%d'%(self.timestamp), self.djones_mat)
 
-        data_reshaped = self.data.reshape((self.data.shape[0],self.data.shape[1],2,2))
-
-        for a0 in range(self.Nant):
-            for a1 in range(a0+1,self.Nant):
-                bl_ind = self.baseline_dict[(a0,a1)]
-                time_ind = 0
-                for ind in bl_ind:
-                  for freq_ind in range(self.num_chan):
-                    data_reshaped[ind,freq_ind] = np.matmul(self.pol_leak_mat[a0,time_ind,freq_ind], np.matmul(data_reshaped[ind,freq_ind], \
-                                         np.conjugate(self.pol_leak_mat[a1,time_ind,freq_ind].T)))
-                  time_ind = time_ind + 1
-                
-        self.data = data_reshaped.reshape(self.data.shape) 
-        self.save_data()
+      self.apply_antenna_jones(pol_leakage_jones, kind='full')
 
 
     def make_pol_plots(self):
@@ -1252,32 +1861,56 @@ class SimCoordinator():
         Add time-varying station-based complex gains.
         """
 
-        self.gain_mat = np.zeros((self.Nant,self.time_unique.shape[0],2,2),dtype=complex)
+        self.gain_mat = np.zeros((self.Nant,self.time_unique.shape[0],2),dtype=complex) # diagonal G-Jones terms
         for ant in range(self.Nant):
-            self.gain_mat[ant,:,0,0] = self.rng_predict.normal(self.gR_mean.real[ant], self.gR_std.real[ant], size=(self.time_unique.shape[0])) + 1j*self.rng_predict.normal(self.gR_mean.imag[ant], self.gR_std.imag[ant], size=(self.time_unique.shape[0]))
-            self.gain_mat[ant,:,1,1] = self.rng_predict.normal(self.gL_mean.real[ant], self.gL_std.real[ant], size=(self.time_unique.shape[0])) + 1j*self.rng_predict.normal(self.gL_mean.imag[ant], self.gL_std.imag[ant], size=(self.time_unique.shape[0]))
+            self.gain_mat[ant,:,0] = self.rng_predict.normal(self.gR_mean.real[ant], self.gR_std.real[ant], size=(self.time_unique.shape[0])) + 1j*self.rng_predict.normal(self.gR_mean.imag[ant], self.gR_std.imag[ant], size=(self.time_unique.shape[0]))
+            self.gain_mat[ant,:,1] = self.rng_predict.normal(self.gL_mean.real[ant], self.gL_std.real[ant], size=(self.time_unique.shape[0])) + 1j*self.rng_predict.normal(self.gL_mean.imag[ant], self.gL_std.imag[ant], size=(self.time_unique.shape[0]))
 
-        np.save(II('$OUTDIR')+'/gterms_timestamp_%d'%(self.timestamp), self.gain_mat) # INI: Add timestamps to the output gain files so that SYMBA has access to them.
+        np.save(II('$OUTDIR')+'/gterms_timestamp_%d'%(self.timestamp), diag_to_full(self.gain_mat)) # INI: Add timestamps to the output gain files so that SYMBA has access to them.
 
-        data_reshaped = self.data.reshape((self.data.shape[0],self.data.shape[1],2,2))
+        gain_mat = self.gain_mat
+        self.apply_antenna_jones(lambda tind, ant: gain_mat[ant, tind][:, np.newaxis], kind='diag')
 
-        for a0 in range(self.Nant):
-            for a1 in range(a0+1,self.Nant):
-                bl_ind = self.baseline_dict[(a0,a1)]
-                utime=0 # INI: the assumption here is that all baselines have an entry for each utime
-                for ind in bl_ind:
-                  data_reshaped[ind] = np.matmul(np.matmul(self.gain_mat[a0,utime], data_reshaped[ind]), np.conjugate(self.gain_mat[a1,utime].T))
-                  utime = utime + 1
+    ##################################
+    # Add noise components
+    def trop_sky_sefd_matrix(self, thermalnoise):
+        """
+        Compute the time- and frequency-dependent SEFD of every antenna due to the sky (and the receiver) and save it.
 
-        self.data = data_reshaped.reshape(self.data.shape)
+        Parameters
+        ----------
+        thermalnoise : bool
+            If True, include the receiver temperature in the system temperature.
 
-        self.save_data()
+        Returns
+        -------
+        sefd_matrix : ndarray
+            SEFD of shape (Ntime, Nchan, Nant).
+        """
+        skytemp_from_emissivity = self.emissivity/(1.-np.exp(-1.0*self.opacity))
+        if thermalnoise:
+            info('Generating tropospheric + thermal noise...')
+            sefd_matrix = (2 * Boltzmann * (self.T_rx + skytemp_from_emissivity * (1.-np.exp(-1.0*self.opacity/np.sin(self.elevation_tropshape)))) / self.dish_area) * 1e26
+            
+        else:
+            info('Generating tropospheric noise...')
+            sefd_matrix = (2 * Boltzmann * (skytemp_from_emissivity * (1.-np.exp(-1.0*self.opacity/np.sin(self.elevation_tropshape)))) / self.dish_area) * 1e26
+
+        np.save(II('$OUTDIR')+'/skytemp_from_emissivity_timestamp_%d'%(self.timestamp), skytemp_from_emissivity)
+        np.save(II('$OUTDIR')+'/elevation_tropshape_timestamp_%d'%(self.timestamp), self.elevation_tropshape) 
+        np.save(II('$OUTDIR')+'/dish_area_timestamp_%d'%(self.timestamp), self.dish_area) 
+        np.save(II('$OUTDIR')+'/atm_output/sefd_matrix_timestamp_%d'%(self.timestamp), sefd_matrix)
+
+        return sefd_matrix
 
-    ##################################
-    # Add noise components
     def add_noise(self, tropnoise, thermalnoise):
         """Add sky and receiver noise components to the visibilities and populate weight columns.
 
+        The noise is added in place, one chunk of rows at a time: the combined rms of every chunk is computed from the
+        per-antenna SEFDs (and sky SEFDs), the noise is realised and added to the chunk, and the SIGMA and WEIGHT
+        columns of the chunk are written. The full-size noise and rms arrays are never formed; only the per-antenna
+        SEFDs are saved.
+
         Parameters
         ----------
         tropnoise : bool
@@ -1285,112 +1918,31 @@ class SimCoordinator():
         thermalnoise : bool
             If True, include receiver noise.
         """
-        self.additive_noise = np.zeros(self.data.shape, dtype='complex')
-
-        # compute receiver rms noise
-        if thermalnoise and not tropnoise:
-            for a0 in range(self.Nant):
-                for a1 in range(self.Nant):
-                    if a1 > a0:
-                        self.receiver_rms[self.baseline_dict[(a0,a1)]] = (1/self.corr_eff) * np.sqrt(self.SEFD_rx[a0] * \
-                                                                          self.SEFD_rx[a1] / float(2 * self.tint * self.chan_width))
-                    
-            # use the receiver rms to realise thermal noise
-            info('Generating thermal noise...')
-            self.thermal_noise = np.zeros(self.data.shape, dtype='complex')
-            size = (self.time_unique.shape[0], self.chan_freq.shape[0], 4)
-            for a0 in range(self.Nant):
-                for a1 in range(self.Nant):
-                    if a1 > a0:
-                        rms = self.receiver_rms[self.baseline_dict[(a0,a1)]]
-                        self.thermal_noise[self.baseline_dict[(a0, a1)]] = self.rng_predict.normal(0.0, rms, size=size) + 1j * self.rng_predict.normal(0.0, rms, size=size)
-
-            np.save(II('$OUTDIR')+'/receiver_noise_timestamp_%d'%(self.timestamp), self.thermal_noise) 
-
-            self.additive_noise += self.thermal_noise # add receiver noise to the full noise array
+        self.apply_jones_chain() # noise is added after any deferred Jones terms
 
         np.save(II('$OUTDIR')+'/T_rx_timestamp_%d'%(self.timestamp), self.T_rx) 
         np.save(II('$OUTDIR')+'/sefd_rx_timestamp_%d'%(self.timestamp), self.SEFD_rx) 
-
-        # compute sky sigma estimator (i.e. sky rms noise) and realise sky noise
+        terms = []
         if tropnoise:
-            skytemp_from_emissivity = self.emissivity/(1.-np.exp(-1.0*self.opacity))
-            if thermalnoise:
-                info('Generating tropospheric + thermal noise...')
-                sefd_matrix = (2 * Boltzmann * (self.T_rx + skytemp_from_emissivity * (1.-np.exp(-1.0*self.opacity/np.sin(self.elevation_tropshape)))) / self.dish_area) * 1e26
-                
-            else:
-                info('Generating tropospheric noise...')
-                sefd_matrix = (2 * Boltzmann * (skytemp_from_emissivity * (1.-np.exp(-1.0*self.opacity/np.sin(self.elevation_tropshape)))) / self.dish_area) * 1e26
-
-            np.save(II('$OUTDIR')+'/skytemp_from_emissivity_timestamp_%d'%(self.timestamp), skytemp_from_emissivity)
-            np.save(II('$OUTDIR')+'/elevation_tropshape_timestamp_%d'%(self.timestamp), self.elevation_tropshape) 
-            np.save(II('$OUTDIR')+'/dish_area_timestamp_%d'%(self.timestamp), self.dish_area) 
-            np.save(II('$OUTDIR')+'/atm_output/sefd_matrix_timestamp_%d'%(self.timestamp), sefd_matrix)
-
-            self.sky_noise = np.zeros(self.data.shape, dtype='complex')
-
-            for a0 in range(self.Nant):
-                for a1 in range(self.Nant):
-                    if a1 > a0:
-                        rms = (1/self.corr_eff) * np.sqrt(sefd_matrix[:, :, a0] * sefd_matrix[:, :, a1] / float(2*self.tint*self.chan_width))
-                        rms = np.expand_dims(rms, 2)
-                        rms = rms * np.ones((1, 1, 4))
-                        self.sky_sigma_estimator[self.baseline_dict[(a0, a1)]] = rms # sky noise rms
-
-                        # compute sky noise and add to additive noies
-                        self.sky_noise[self.baseline_dict[(a0, a1)]] = self.rng_atm.normal(0.0, rms) + 1j * self.rng_atm.normal(0.0, rms)
-                        
-            np.save(II('$OUTDIR')+'/atm_output/sky_noise_timestamp_%d'%(self.timestamp), self.sky_noise)
-            np.save(II('$OUTDIR')+'/atm_output/sky_sigma_estimator_timestamp_%d'%(self.timestamp), self.sky_sigma_estimator)
-
-            # add sky noise generated from sky sigma estimator to the full noise array
-            try:
-              for tind in range(self.nchunks):
-                self.additive_noise[tind*self.chunksize:(tind+1)*self.chunksize] += self.sky_noise[tind*self.chunksize:(tind+1)*self.chunksize]
-            except MemoryError:
-              abort("Arrays too large to be held in memory. Aborting execution.")
-
-            # add sky noise rms to receiver rms if tropnoise is set
-            try:
-              for tind in range(self.nchunks):
-                self.receiver_rms[tind*self.chunksize:(tind+1)*self.chunksize] = np.sqrt(np.power(self.receiver_rms[tind*self.chunksize:(tind+1)*self.chunksize], 2) + \
-                                                                               np.power(self.sky_sigma_estimator[tind*self.chunksize:(tind+1)*self.chunksize], 2))
-            except MemoryError:
-              abort("Arrays too large to be held in memory. Aborting execution.")
-
-        # add both the noise components to the data
-        try:
-          info('Applying additive noise to data...')
-          for tind in range(self.nchunks):
-            self.data[tind*self.chunksize:(tind+1)*self.chunksize] += self.additive_noise[tind*self.chunksize:(tind+1)*self.chunksize]
-          self.save_data()
-        except MemoryError:
-          abort("Arrays too large to be held in memory. Aborting execution.")
-
-        # save receiver_rms (which may or may not have been populated based on noise flags)
-        np.save(II('$OUTDIR')+'/receiver_rms_timestamp_%d'%(self.timestamp), self.receiver_rms)
-
-        # populate MS weight and sigma columns using the receiver rms (with or without sky noise)
-        tab = pt.table(self.msname, readonly=False,ack=False)
-
-        tab.putcol("SIGMA", self.receiver_rms[:,0,:])
-        if 'SIGMA_SPECTRUM' in tab.colnames():
-            tab.putcol("SIGMA_SPECTRUM", self.receiver_rms)
-
-        if not tropnoise and not thermalnoise:
-            tab.putcol("WEIGHT", self.receiver_rms[:,0,:]+1)
-            if 'WEIGHT_SPECTRUM' in tab.colnames():
-                tab.putcol("WEIGHT_SPECTRUM", self.receiver_rms+1)
-        else:
-            tab.putcol("WEIGHT", 1/self.receiver_rms[:,0,:]**2)
-            if 'WEIGHT_SPECTRUM' in tab.colnames():
-                tab.putcol("WEIGHT_SPECTRUM", 1/self.receiver_rms**2)
-        tab.close()
+            # INI: the sky SEFDs include the receiver temperature if thermalnoise is set
+            sefd_matrix = self.trop_sky_sefd_matrix(thermalnoise)
+            terms.append((self.sky_noise_keys, lambda rows: self.sky_rms_rows(sefd_matrix, rows)))
+        elif thermalnoise:
+            info('Generating thermal noise...')
+            terms.append((self.thermal_noise_keys, self.receiver_rms_rows))
+        self.noise_terms += terms
+        self.trailing_noise_terms += terms
+
+        def add_noise_rows(tab, data, block, rows):
+            noise, rms = self.realise_noise_terms(terms, rows)
+            data += noise
+            self.put_sigma_weight(tab, rms, tropnoise or thermalnoise, startrow=block.start)
+
+        info('Applying additive noise to data...')
+        self.apply_row_op(add_noise_rows)
+        if not self.fuse_corruptions:
+            self.save_data()
 
-    #############################
-    ##### General MS plots  #####
-    #############################
 
     def make_ms_plots(self):
         """uv-coverage, uv-dist sensitivty bins, etc. All by baseline colour"""
@@ -1410,7 +1962,7 @@ class SimCoordinator():
                         and not ((self.station_names[ant0]=='JCMT') or (self.station_names[ant1] == 'JCMT')) \
                         and not ((self.station_names[ant0]=='APEX') or (self.station_names[ant1] == 'APEX')):
 
-                    temp_mask = np.logical_not(self.flag[self.baseline_dict[(ant0,ant1)],0,0])
+                    temp_mask = np.logical_not(self.row_flag[self.baseline_dict[(ant0,ant1)]])
                     temp_u = self.uvw[self.baseline_dict[(ant0,ant1)][temp_mask], 0]\
                          / (speed_of_light/self.chan_freq.mean())/1e9
                     temp_v = self.uvw[self.baseline_dict[(ant0,ant1)][temp_mask], 1]\
@@ -1458,7 +2010,7 @@ class SimCoordinator():
                 if (ant1 > ant0) \
                         and not ((self.station_names[ant0]=='JCMT') or (self.station_names[ant1] == 'JCMT')) \
                         and not ((self.station_names[ant0]=='APEX') or (self.station_names[ant1] == 'APEX')):
-                    temp_mask = np.logical_not(self.flag[self.baseline_dict[(ant0,ant1)],0,0])
+                    temp_mask = np.logical_not(self.row_flag[self.baseline_dict[(ant0,ant1)]])
                     self.temp_u = self.uvw[self.baseline_dict[(ant0,ant1)][temp_mask], 0]\
                          / (speed_of_light/self.chan_freq.mean())/1e9
                     self.temp_v = self.uvw[self.baseline_dict[(ant0,ant1)][temp_mask], 1]\
@@ -1496,7 +2048,7 @@ class SimCoordinator():
                 if (ant1 > ant0) \
                         and not ((self.station_names[ant0]=='JCMT') or (self.station_names[ant1] == 'JCMT')) \
                         and not ((self.station_names[ant0]=='APEX') or (self.station_names[ant1] == 'APEX')):
-                    temp_mask = np.logical_not(self.flag[self.baseline_dict[(ant0,ant1)],0,0])
+                    temp_mask = np.logical_not(self.row_flag[self.baseline_dict[(ant0,ant1)]])
                     self.temp_u = self.uvw[self.baseline_dict[(ant0,ant1)][temp_mask], 0]\
                          / (speed_of_light/self.chan_freq.mean())/1e9
                     self.temp_v = self.uvw[self.baseline_dict[(ant0,ant1)][temp_mask], 1]\
@@ -1520,143 +2072,143 @@ class SimCoordinator():
         pl.savefig(os.path.join(v.PLOTDIR, 'uv-coverage_colorize_mean_elevation.png'), \
                     bbox_inches='tight')
 
-        ampbins = np.zeros([numuvbins])
-        stdbins = np.zeros([numuvbins])
-        phasebins = np.zeros([numuvbins])
-        phstdbins = np.zeros([numuvbins])
-        Nvisperbin = np.zeros([numuvbins])
-        corrs = [0,3] # only doing Stokes I for now
-
-        for b in range(numuvbins):
-            mask = ( (self.uvdist / (speed_of_light/self.chan_freq.mean())/1e9) > uvbins_edges[b]) & \
-                   ( (self.uvdist / (speed_of_light/self.chan_freq.mean())/1e9) < uvbins_edges[b + 1]) & \
-                   (np.logical_not(self.flag[:, 0, 0]))  # mask of unflagged visibilities in this uvbin
-            Nvisperbin[b] = mask.sum()  # total number of visibilities in this uvbin
-            ampbins[b] = np.nanmean(abs(self.data[mask, :, :])[:, :, corrs])  # average amplitude in bin "b"
-            #stdbins[b] = np.nanstd(abs(self.data[mask, :, :])[:, :, corrs]) / Nvisperbin[b]**0.5  # rms of that bin
-
-            if (self.trop_enabled) and (self.thermal_noise_enabled):
-                stdbins[b] = np.nanmean(abs(np.add(self.additive_noise[mask, :, :][:, :, corrs], \
-                                                   self.sky_noise[mask, :, :][:, :, corrs]))) / Nvisperbin[b] ** 0.5
-            elif (not self.trop_enabled) and (self.thermal_noise_enabled):
-                stdbins[b] = np.nanmean(abs(self.additive_noise[mask, :, :][:, :, corrs])) \
-                                        / Nvisperbin[b] ** 0.5
-            elif (self.trop_enabled) and (not self.thermal_noise_enabled):
-                if self.sky_noise is not None:
-                    stdbins[b] = np.nanmean(abs(self.sky_noise[mask, :, :][:, :, corrs])) \
-                                            / Nvisperbin[b] ** 0.5
-            else:
-                stdbins[b] = np.nanstd(abs(self.data[mask, :, :])[:, :, corrs]) / Nvisperbin[b]**0.5  # rms of that bin
-            # next few lines if a comparison array is desired (e.g. EHT minus ALMA)
-            #mask_minus1ant = (uvdist > uvbins_edges[b])&(uvdist< uvbins_edges[b+1])&(np.logical_not(flag_col[:,0,0]))& \
-            # (ant1 != station_name.index('ALMA'))&(ant2 != station_name.index('ALMA'))
-            # mask of unflagged visibilities in this uvbin, that don't include any ALMA baselines
-            #Nvisperbin_minus1ant[b] = mask_nomk.sum()  # total number of visibilities in this uvbin
-            #ampbins_minus1ant[b] = np.nanmean(abs(data[mask_nomk, :, :])[:, :, corrs])  # average amplitude in bin "b"
-            #stdbins_minus1ant[b] = np.nanstd(abs(data[mask_nomk, :, :])[:, :, corrs]) / Nvisperbin_nomk[b] ** 0.5  # rms of that bin
-
-            phasebins[b] = np.nanmean(np.arctan2(self.data[mask, :, :].imag, \
-                                                 self.data[mask, :, :].real)[:, :,
-                                      corrs])  # average phase in bin "b"
-            phstdbins[b] = np.nanstd(np.arctan2(self.data[mask, :, :].imag, \
-                                                self.data[mask, :, :].real)[:, :, corrs])  # rms of that bin
-
-        phasebins *= (180 / np.pi)
-        phstdbins *= (180 / np.pi)  # rad2deg
-
-        def uvdist2uas(uvd):
-            theta = 1. / (uvd * 1e9) * 206265 * 1e6  # Giga-lambda to uas
-            return ["%.1f" % z for z in theta]
-
-        def uas2uvdist(ang):
-            return 1. / (ang / (206265. * 1e6)) / 1e9
-
-        ### this is for a top x-axis labels, showing corresponding angular scale for a uv-distance
-        angular_tick_locations = [25, 50, 100, 200]  # specify which uvdist locations you want a angular scale
-
-        ### amp vs uvdist, with uncertainties
-        fig = pl.figure(figsize=(10,6.8))
-        ax1 = fig.add_subplot(111)
-        ax2 = ax1.twiny()
-        yerr = stdbins/np.sqrt(Nvisperbin) #noise_per_vis/np.sqrt(np.sum(Nvisperbin,axis=0)) #yerr = noise_per_vis/np.sqrt(np.sum(allsrcs[:,2,:],axis=0))
-        xerr = binwidths/2. * np.ones(numuvbins)
-        for b in range(numuvbins):
-            ax1.plot(uvbins_centre[b],ampbins[b],'o',mec='none',alpha=1,color='#336699')
-            ax1.errorbar(uvbins_centre[b],ampbins[b],xerr=xerr[b],yerr=yerr[b],ecolor='grey',lw=0.5,alpha=1,fmt='none',capsize=0)
-        #ax1.vlines(uas2uvdist(shadow_size_mas),0,np.nanmax(ampbins)*1.2,linestyles='dashed')
-        ax1.set_xlabel('${uv}$-distance / G$\,\lambda$', fontsize=FSIZE)
-        ax1.set_ylabel('Stokes I amplitude / Jy', fontsize=FSIZE)
-        ax1.set_ylim(0,np.nanmax(ampbins)*1.2)
-        ax1.set_xlim(0,uvbins_edges.max())
-        ax2.set_xlim(ax1.get_xlim())
-
-        # configure upper x-axis
-
-        ax2.set_xticks(uas2uvdist(np.array(angular_tick_locations))) # np.array([25.,50.,100.,200.]))) #   angular_tick_locations))
-        ax2.set_xticklabels(angular_tick_locations)
-        #ax2.xaxis.set_major_formatter(FormatStrFormatter('%i'))
-        ax2.set_xlabel("Angular scale / $\mu$-arcsec", fontsize=FSIZE)
-        #np.savetxt('uvdistplot_ampdatapts.txt',np.vstack([uvbins_centre,xerr,ampbins,yerr]))
-        pl.savefig(os.path.join(v.PLOTDIR,'amp_uvdist.png'), \
-                   bbox_inches='tight')
-
-        ### percent of visibilties per bin
-        percentVisperbin = Nvisperbin/Nvisperbin.sum()*100
-        #percentVisperbin_minus1ant = Nvisperbin_minus1ant/Nvisperbin_minus1ant.sum()*100
-        #percent_increase = (Nvisperbin/Nvisperbin_minus1ant -1) * 100
-
-        fig = pl.figure(figsize=(10,6.8))
-        ax1 = fig.add_subplot(111)
-        ax2 = ax1.twiny()
-        for b in range(numuvbins):
-            #ax1.bar(uvbins_centre[b],percent_increase[b],width=binwidths,color='orange',alpha=1) #,label='MeerKAT included')
-            ax1.bar(uvbins_centre[b],percentVisperbin[b],width=binwidths,color='orange',alpha=0.9,align='center',edgecolor='none') #,label='')
-            #ax1.bar(uvbins_centre[b],percentVisperbin_minus1ant[b],width=binwidths,color='#336699',alpha=0.6,label='MeerKAT excluded')
-        ax1.set_xlabel('$uv$-distance / G$\,\lambda$', fontsize=FSIZE)
-        ax1.set_ylabel('Percentage of total visibilities', fontsize=FSIZE)
-        #ax1.set_ylabel('percentage increase')
-        #ax1.set_ylim(0,np.nanmax(percentVisperbin)*1.2)
-        #ax1.set_ylim(0,percent_increase.max()*1.2)
-        ax1.set_xlim(0,uvbins_edges.max())
-        #ax1.vlines(uas2uvdist(shadow_size_uarcsec),0,np.nanmax(Nvisperbin)*1.2,linestyles='dashed')
-        ax2.set_xlim(ax1.get_xlim())
-        # configure upper x-axis
-        ax2.set_xticks(uas2uvdist(np.array(angular_tick_locations)))
-        ax2.set_xticklabels(angular_tick_locations) #(angular_tick_locations))
-        ax2.set_xlabel(r"Angular scale / $\mu$-arcsec", fontsize=FSIZE)
-        #pl.legend()
-        pl.savefig(os.path.join(v.PLOTDIR,'num_vis_perbin.png'), \
-                   bbox_inches='tight')
-
-        ### averaged sensitivity per bin
-        fig = pl.figure(figsize=(10,6.8))
-        ax1 = fig.add_subplot(111)
-        ax2 = ax1.twiny()
-        #x_vlba,y_vlba = np.loadtxt('/home/deane/git-repos/vlbi-sim/output/XMM-LSS/vlba_xmmlss_sigma_vs_uvbin.txt').T #/home/deane/git-repos/vlbi-sim/output/VLBA_COSMOS/vlba_sigma_vs_uvbin.txt',comments='#').T
-        x = np.ravel(list(zip(uvbins_edges[:-1],uvbins_edges[1:])))
-        y = np.ravel(list(zip(stdbins,stdbins)))
-        #y_minus1ant = np.ravel(zip(stdbins_minus1ant,stdbins_minus1ant))
-
-        #ax1.plot(x_vlba,y_vlba*1e6,color='grey',alpha=1,label='VLBA',lw=3)
-        ax1.plot(x,y*1e3,color='#336699',linestyle='solid',alpha=1,label='EHT',lw=3)
-        #ax1.plot(x,y*1e6,color='orange',alpha=0.7,label='EVN + MeerKAT',lw=3)
-
-        ax1.set_xlabel('$uv$-distance / G$\,\lambda$', fontsize=18)
-        ax1.set_ylabel('Thermal + sky noise rms / mJy', fontsize=18)
-        #ax1.set_ylabel('percentage increase')
-        ax1.set_ylim(0,np.nanmax(y)*1.2*1e3)
-        ax1.set_xlim(0,uvbins_edges.max())
-        ax1.tick_params(axis='both', which='major', labelsize=12)
-        #ax1.vlines(uas2uvdist(shadow_size_uarcsec),0,np.nanmax(Nvisperbin)*1.2,linestyles='dashed')
-        ax2.set_xlim(ax1.get_xlim())
-        # configure upper x-axis
-        ax2.set_xticks(uas2uvdist(np.array(angular_tick_locations)))
-        ax2.set_xticklabels(angular_tick_locations)
-        ax2.set_xlabel(r"angular scale / $\mu$-arcsec", fontsize=FSIZE)
-        ax2.tick_params(axis='both', which='major', labelsize=12)
-        #ax1.legend(loc='upper left',fontsize=16)
-        pl.savefig(os.path.join(v.PLOTDIR, 'sensitivity_perbin.png'), \
-             bbox_inches = 'tight')
+        if self.streaming:
+            warn('Visibilities are not held in memory when streaming. Skipping the amplitude, visibility count and sensitivity vs uv-distance plots.')
+        else:
+            ampbins = np.zeros([numuvbins])
+            stdbins = np.zeros([numuvbins])
+            phasebins = np.zeros([numuvbins])
+            phstdbins = np.zeros([numuvbins])
+            Nvisperbin = np.zeros([numuvbins])
+            corrs = [0,3] # only doing Stokes I for now
+            if self.noise_terms:
+                # INI: mean noise amplitude of every row, i.e. the mean of the Rayleigh distribution of |noise|
+                noise_amp = np.zeros(self.nrows)
+                for block, rows in self.active_chunks():
+                    noise_amp[rows] = np.sqrt(np.pi / 2) * np.nanmean(self.noise_rms_rows(rows)[:, :, corrs], axis=(1, 2))
+
+            for b in range(numuvbins):
+                mask = ( (self.uvdist / (speed_of_light/self.chan_freq.mean())/1e9) > uvbins_edges[b]) & \
+                       ( (self.uvdist / (speed_of_light/self.chan_freq.mean())/1e9) < uvbins_edges[b + 1]) & \
+                       (np.logical_not(self.row_flag))  # mask of unflagged visibilities in this uvbin
+                Nvisperbin[b] = mask.sum()  # total number of visibilities in this uvbin
+                ampbins[b] = np.nanmean(abs(self.data[mask, :, :])[:, :, corrs])  # average amplitude in bin "b"
+                #stdbins[b] = np.nanstd(abs(self.data[mask, :, :])[:, :, corrs]) / Nvisperbin[b]**0.5  # rms of that bin
+
+                if self.noise_terms:
+                    stdbins[b] = np.nanmean(noise_amp[mask]) / Nvisperbin[b] ** 0.5
+                else:
+                    stdbins[b] = np.nanstd(abs(self.data[mask, :, :])[:, :, corrs]) / Nvisperbin[b]**0.5  # rms of that bin
+                # next few lines if a comparison array is desired (e.g. EHT minus ALMA)
+                #mask_minus1ant = (uvdist > uvbins_edges[b])&(uvdist< uvbins_edges[b+1])&(np.logical_not(flag_col[:,0,0]))& \
+                # (ant1 != station_name.index('ALMA'))&(ant2 != station_name.index('ALMA'))
+                # mask of unflagged visibilities in this uvbin, that don't include any ALMA baselines
+                #Nvisperbin_minus1ant[b] = mask_nomk.sum()  # total number of visibilities in this uvbin
+                #ampbins_minus1ant[b] = np.nanmean(abs(data[mask_nomk, :, :])[:, :, corrs])  # average amplitude in bin "b"
+                #stdbins_minus1ant[b] = np.nanstd(abs(data[mask_nomk, :, :])[:, :, corrs]) / Nvisperbin_nomk[b] ** 0.5  # rms of that bin
+
+                phasebins[b] = np.nanmean(np.arctan2(self.data[mask, :, :].imag, \
+                                                     self.data[mask, :, :].real)[:, :,
+                                          corrs])  # average phase in bin "b"
+                phstdbins[b] = np.nanstd(np.arctan2(self.data[mask, :, :].imag, \
+                                                    self.data[mask, :, :].real)[:, :, corrs])  # rms of that bin
+
+            phasebins *= (180 / np.pi)
+            phstdbins *= (180 / np.pi)  # rad2deg
+
+            def uvdist2uas(uvd):
+                theta = 1. / (uvd * 1e9) * 206265 * 1e6  # Giga-lambda to uas
+                return ["%.1f" % z for z in theta]
+
+            def uas2uvdist(ang):
+                return 1. / (ang / (206265. * 1e6)) / 1e9
+
+            ### this is for a top x-axis labels, showing corresponding angular scale for a uv-distance
+            angular_tick_locations = [25, 50, 100, 200]  # specify which uvdist locations you want a angular scale
+
+            ### amp vs uvdist, with uncertainties
+            fig = pl.figure(figsize=(10,6.8))
+            ax1 = fig.add_subplot(111)
+            ax2 = ax1.twiny()
+            yerr = stdbins/np.sqrt(Nvisperbin) #noise_per_vis/np.sqrt(np.sum(Nvisperbin,axis=0)) #yerr = noise_per_vis/np.sqrt(np.sum(allsrcs[:,2,:],axis=0))
+            xerr = binwidths/2. * np.ones(numuvbins)
+            for b in range(numuvbins):
+                ax1.plot(uvbins_centre[b],ampbins[b],'o',mec='none',alpha=1,color='#336699')
+                ax1.errorbar(uvbins_centre[b],ampbins[b],xerr=xerr[b],yerr=yerr[b],ecolor='grey',lw=0.5,alpha=1,fmt='none',capsize=0)
+            #ax1.vlines(uas2uvdist(shadow_size_mas),0,np.nanmax(ampbins)*1.2,linestyles='dashed')
+            ax1.set_xlabel('${uv}$-distance / G$\,\lambda$', fontsize=FSIZE)
+            ax1.set_ylabel('Stokes I amplitude / Jy', fontsize=FSIZE)
+            ax1.set_ylim(0,np.nanmax(ampbins)*1.2)
+            ax1.set_xlim(0,uvbins_edges.max())
+            ax2.set_xlim(ax1.get_xlim())
+
+            # configure upper x-axis
+
+            ax2.set_xticks(uas2uvdist(np.array(angular_tick_locations))) # np.array([25.,50.,100.,200.]))) #   angular_tick_locations))
+            ax2.set_xticklabels(angular_tick_locations)
+            #ax2.xaxis.set_major_formatter(FormatStrFormatter('%i'))
+            ax2.set_xlabel("Angular scale / $\mu$-arcsec", fontsize=FSIZE)
+            #np.savetxt('uvdistplot_ampdatapts.txt',np.vstack([uvbins_centre,xerr,ampbins,yerr]))
+            pl.savefig(os.path.join(v.PLOTDIR,'amp_uvdist.png'), \
+                       bbox_inches='tight')
+
+            ### percent of visibilties per bin
+            percentVisperbin = Nvisperbin/Nvisperbin.sum()*100
+            #percentVisperbin_minus1ant = Nvisperbin_minus1ant/Nvisperbin_minus1ant.sum()*100
+            #percent_increase = (Nvisperbin/Nvisperbin_minus1ant -1) * 100
+
+            fig = pl.figure(figsize=(10,6.8))
+            ax1 = fig.add_subplot(111)
+            ax2 = ax1.twiny()
+            for b in range(numuvbins):
+                #ax1.bar(uvbins_centre[b],percent_increase[b],width=binwidths,color='orange',alpha=1) #,label='MeerKAT included')
+                ax1.bar(uvbins_centre[b],percentVisperbin[b],width=binwidths,color='orange',alpha=0.9,align='center',edgecolor='none') #,label='')
+                #ax1.bar(uvbins_centre[b],percentVisperbin_minus1ant[b],width=binwidths,color='#336699',alpha=0.6,label='MeerKAT excluded')
+            ax1.set_xlabel('$uv$-distance / G$\,\lambda$', fontsize=FSIZE)
+            ax1.set_ylabel('Percentage of total visibilities', fontsize=FSIZE)
+            #ax1.set_ylabel('percentage increase')
+            #ax1.set_ylim(0,np.nanmax(percentVisperbin)*1.2)
+            #ax1.set_ylim(0,percent_increase.max()*1.2)
+            ax1.set_xlim(0,uvbins_edges.max())
+            #ax1.vlines(uas2uvdist(shadow_size_uarcsec),0,np.nanmax(Nvisperbin)*1.2,linestyles='dashed')
+            ax2.set_xlim(ax1.get_xlim())
+            # configure upper x-axis
+            ax2.set_xticks(uas2uvdist(np.array(angular_tick_locations)))
+            ax2.set_xticklabels(angular_tick_locations) #(angular_tick_locations))
+            ax2.set_xlabel(r"Angular scale / $\mu$-arcsec", fontsize=FSIZE)
+            #pl.legend()
+            pl.savefig(os.path.join(v.PLOTDIR,'num_vis_perbin.png'), \
+                       bbox_inches='tight')
+
+            ### averaged sensitivity per bin
+            fig = pl.figure(figsize=(10,6.8))
+            ax1 = fig.add_subplot(111)
+            ax2 = ax1.twiny()
+            #x_vlba,y_vlba = np.loadtxt('/home/deane/git-repos/vlbi-sim/output/XMM-LSS/vlba_xmmlss_sigma_vs_uvbin.txt').T #/home/deane/git-repos/vlbi-sim/output/VLBA_COSMOS/vlba_sigma_vs_uvbin.txt',comments='#').T
+            x = np.ravel(list(zip(uvbins_edges[:-1],uvbins_edges[1:])))
+            y = np.ravel(list(zip(stdbins,stdbins)))
+            #y_minus1ant = np.ravel(zip(stdbins_minus1ant,stdbins_minus1ant))
+
+            #ax1.plot(x_vlba,y_vlba*1e6,color='grey',alpha=1,label='VLBA',lw=3)
+            ax1.plot(x,y*1e3,color='#336699',linestyle='solid',alpha=1,label='EHT',lw=3)
+            #ax1.plot(x,y*1e6,color='orange',alpha=0.7,label='EVN + MeerKAT',lw=3)
+
+            ax1.set_xlabel('$uv$-distance / G$\,\lambda$', fontsize=18)
+            ax1.set_ylabel('Thermal + sky noise rms / mJy', fontsize=18)
+            #ax1.set_ylabel('percentage increase')
+            ax1.set_ylim(0,np.nanmax(y)*1.2*1e3)
+            ax1.set_xlim(0,uvbins_edges.max())
+            ax1.tick_params(axis='both', which='major', labelsize=12)
+            #ax1.vlines(uas2uvdist(shadow_size_uarcsec),0,np.nanmax(Nvisperbin)*1.2,linestyles='dashed')
+            ax2.set_xlim(ax1.get_xlim())
+            # configure upper x-axis
+            ax2.set_xticks(uas2uvdist(np.array(angular_tick_locations)))
+            ax2.set_xticklabels(angular_tick_locations)
+            ax2.set_xlabel(r"angular scale / $\mu$-arcsec", fontsize=FSIZE)
+            ax2.tick_params(axis='both', which='major', labelsize=12)
+            #ax1.legend(loc='upper left',fontsize=16)
+            pl.savefig(os.path.join(v.PLOTDIR, 'sensitivity_perbin.png'), \
+                 bbox_inches = 'tight')
 
         ### elevation vs time ###
         pl.figure(figsize=(10,6.8))
@@ -0,0 +1,207 @@
+# coding: utf-8
+import os
+import shlex
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from scipy.interpolate import RegularGridInterpolator
+from meqsilhouette.utils.disk_cache import array_digest, load_cached, save_cached, evict_lru
+
+def aatm_command(program, fmin, fmax, fstep, pwv, gpress, gtemp):
+    """
+    Build the command line of an AATM program.
+
+    Parameters
+    ----------
+    program : str
+        AATM program, 'absorption' or 'dispersive'.
+    fmin, fmax, fstep : float
+        Frequency grid in GHz.
+    pwv : float
+        Precipitable water vapour in mm.
+    gpress : float
+        Ground pressure in mbar.
+    gtemp : float
+        Ground temperature in K.
+
+    Returns
+    -------
+    str
+        The command line.
+    """
+    return '%s --fmin %f --fmax %f --fstep %f --pwv %f --gpress %f --gtemp %f'%(program, fmin, fmax, fstep, pwv, gpress, gtemp)
+
+
+def parse_aatm_output(output, usecols):
+    """
+    Parse the output of an AATM program, i.e. a header line followed by one line of comma-separated values per frequency.
+    Only the requested columns are converted, so that any other (e.g. empty or non-numeric) fields are ignored.
+
+    Parameters
+    ----------
+    output : bytes
+        Standard output of the program.
+    usecols : list of int
+        Columns to read; column 0 is the frequency.
+
+    Returns
+    -------
+    ndarray
+        Table of shape (nfreq, len(usecols)).
+    """
+    lines = [line.split(',') for line in output.decode().splitlines()[1:] if line.strip()]
+    return np.array([[float(fields[col]) for col in usecols] for fields in lines]).reshape((len(lines), len(usecols)))
+
+
+def run_aatm(commands, nworkers=0, cache_dir=None, cache_size=None):
+    """
+    Run AATM commands concurrently. Identical commands are run only once. If cache_dir is set, the output
+    of every command is looked up in (and saved to) a persistent cache keyed by the command line.
+
+    Parameters
+    ----------
+    commands : list of str
+        Command lines, e.g. returned by aatm_command.
+    nworkers : int
+        Maximum number of concurrent processes. If less than 1, the number of CPUs is used.
+    cache_dir : str
+        Cache directory. If None, the outputs are not cached.
+    cache_size : int
+        Maximum size of the cache in bytes. The least recently used outputs are evicted beyond this size.
+        If None, the cache is not bounded.
+
+    Returns
+    -------
+    outputs : dict
+        Standard output of every unique command.
+    """
+    unique_commands = list(dict.fromkeys(commands))
+    outputs = {}
+    if cache_dir:
+        keys = dict((command, array_digest(np.frombuffer(command.encode(), dtype=np.uint8))) for command in unique_commands)
+        for command in unique_commands:
+            cached = load_cached(cache_dir, keys[command], ['output'])
+            if cached is not None:
+                outputs[command] = cached['output'].tobytes()
+
+    missing = [command for command in unique_commands if command not in outputs]
+    if missing:
+        if nworkers < 1:
+            nworkers = os.cpu_count() or 1
+        with ThreadPoolExecutor(max_workers=min(nworkers, len(missing))) as pool:
+            outputs.update(zip(missing, pool.map(lambda command: subprocess.check_output(shlex.split(command)), missing)))
+
+    if cache_dir and missing:
+        for command in missing:
+            save_cached(cache_dir, keys[command], {'output': np.frombuffer(outputs[command], dtype=np.uint8)})
+        if cache_size is not None:
+            evict_lru(cache_dir, cache_size)
+    return outputs
+
+
+# INI: columns read from the output of the AATM programs, i.e. the frequency and the three quantities of each program
+AATM_COLUMNS = [0, 1, 2, 3]
+
+# INI: quantities tabulated in an atmosphere grid, with the AATM program and output column they are read from
+ATM_GRID_QUANTITIES = [('dry_opacity', 'absorption', 1), ('wet_opacity', 'absorption', 2), ('emissivity', 'absorption', 3),
+                       ('wet_non_disp', 'dispersive', 1), ('wet_disp', 'dispersive', 2), ('dry_non_disp', 'dispersive', 3)]
+
+def build_atm_grid(pwv, gpress, gtemp, fmin, fmax, fstep, nworkers=0, cache_dir=None, cache_size=None):
+    """
+    Tabulate the AATM opacities, emissivity and path lengths over a grid of weather parameters and frequencies.
+
+    Parameters
+    ----------
+    pwv, gpress, gtemp : ndarray
+        Increasing grid nodes of precipitable water vapour (mm), ground pressure (mbar) and ground temperature (K).
+    fmin, fmax, fstep : float
+        Frequency grid in GHz, as passed to AATM.
+    nworkers : int
+        Maximum number of concurrent AATM processes (see run_aatm).
+    cache_dir : str
+        AATM cache directory (see run_aatm).
+    cache_size : int
+        Maximum size of the AATM cache in bytes (see run_aatm).
+
+    Returns
+    -------
+    grid : dict
+        The grid nodes 'pwv', 'gpress', 'gtemp' and 'freq' (GHz), and every quantity in ATM_GRID_QUANTITIES as
+        an array of shape (npwv, ngpress, ngtemp, nfreq).
+    """
+    nodes = [(p, g, t) for p in pwv for g in gpress for t in gtemp]
+    commands = dict((program, [aatm_command(program, fmin, fmax, fstep, p, g, t) for p, g, t in nodes]) for program in ('absorption', 'dispersive'))
+    outputs = run_aatm(commands['absorption'] + commands['dispersive'], nworkers, cache_dir, cache_size)
+    tables = dict((program, np.array([parse_aatm_output(outputs[command], AATM_COLUMNS) for command in commands[program]])) for program in commands)
+
+    freq = tables['absorption'][0, :, 0]
+    if tables['dispersive'].shape[1] != freq.shape[0]:
+        raise ValueError('AATM absorption and dispersive outputs have different numbers of frequency channels')
+    shape = (len(pwv), len(gpress), len(gtemp), freq.shape[0])
+    grid = {'pwv': np.asarray(pwv, dtype=float), 'gpress': np.asarray(gpress, dtype=float), 'gtemp': np.asarray(gtemp, dtype=float), 'freq': freq}
+    for quantity, program, column in ATM_GRID_QUANTITIES:
+        grid[quantity] = tables[program][:, :, column].reshape(shape)
+    return grid
+
+
+def save_atm_grid(filename, grid):
+    """
+    Save an atmosphere grid (see build_atm_grid) as a compressed npz file. The quantities are kept in double precision,
+    since the mean path lengths are converted to phases of up to ~1e4 radians.
+    """
+    np.savez_compressed(filename, **grid)
+
+
+def load_atm_grid(filename):
+    """
+    Load an atmosphere grid saved by save_atm_grid.
+
+    Returns
+    -------
+    grid : dict
+        See build_atm_grid.
+    """
+    with np.load(filename) as npz:
+        return dict((name, npz[name]) for name in npz.files)
+
+
+def interpolate_atm_grid(grid, quantity, pwv, gpress, gtemp, freq):
+    """
+    Interpolate a quantity of an atmosphere grid (multi-)linearly in weather parameters and frequency.
+    Grid axes with a single node are taken to be constant along that axis.
+
+    Parameters
+    ----------
+    grid : dict
+        Atmosphere grid (see build_atm_grid).
+    quantity : str
+        One of the quantities in ATM_GRID_QUANTITIES.
+    pwv, gpress, gtemp : ndarray
+        Weather parameters, e.g. one per antenna, or per antenna and time. Must be broadcastable to a common shape.
+    freq : ndarray
+        Frequencies in GHz.
+
+    Returns
+    -------
+    ndarray
+        The quantity of shape broadcast(pwv, gpress, gtemp).shape + (nfreq,).
+
+    Raises
+    ------
+    ValueError
+        If any of the inputs lies outside the grid.
+    """
+    pwv, gpress, gtemp = np.broadcast_arrays(pwv, gpress, gtemp)
+    freq = np.asarray(freq, dtype=float)
+    axes = [grid['pwv'], grid['gpress'], grid['gtemp'], grid['freq']]
+    coords = [np.repeat(pwv.reshape(-1, 1), freq.shape[0], axis=1), np.repeat(gpress.reshape(-1, 1), freq.shape[0], axis=1),
+              np.repeat(gtemp.reshape(-1, 1), freq.shape[0], axis=1), np.broadcast_to(freq, (pwv.size, freq.shape[0]))]
+
+    values = np.asarray(grid[quantity], dtype=float)
+    keep = [axis.shape[0] > 1 for axis in axes]
+    values = values.reshape([axis.shape[0] for axis, k in zip(axes, keep) if k])
+    if not any(keep):
+        return np.full(pwv.shape + freq.shape, values.item())
+    interpolator = RegularGridInterpolator([axis for axis, k in zip(axes, keep) if k], values)
+    points = np.stack([coord.ravel() for coord, k in zip(coords, keep) if k], axis=-1)
+    return interpolator(points).reshape(pwv.shape + freq.shape)
@@ -0,0 +1,125 @@
+# coding: utf-8
+import numpy as np
+
+def row_time_index(time, time_unique):
+    """
+    Map every row of the MS onto its index in the array of unique timestamps.
+
+    Parameters
+    ----------
+    time : ndarray
+        TIME column of the MS.
+    time_unique : ndarray
+        Sorted unique timestamps in the MS.
+
+    Returns
+    -------
+    ndarray
+        Index into time_unique for every row.
+    """
+    return np.searchsorted(time_unique, time)
+
+
+def apply_jones(vis, jones0, jones1, kind):
+    """
+    Apply per-row antenna-based Jones terms to a block of visibilities in place, i.e.
+    V = J0 V J1^H for every row and channel.
+
+    Parameters
+    ----------
+    vis : ndarray
+        Visibilities of shape (nrow, nchan, 4), modified in place.
+    jones0, jones1 : ndarray
+        Jones terms of the first and second antenna of every row. Must be broadcastable
+        to (nrow, nchan) for kind 'scalar', to (nrow, nchan, 2) for kind 'diag' (i.e. the
+        diagonal of the Jones matrix) or to (nrow, nchan, 2, 2) for kind 'full'.
+    kind : str
+        One of 'scalar', 'diag' or 'full'.
+    """
+    if kind == 'scalar':
+        vis *= np.expand_dims(jones0 * np.conjugate(jones1), -1)
+    elif kind == 'diag':
+        # RR*g0_R*conj(g1_R), RL*g0_R*conj(g1_L), LR*g0_L*conj(g1_R), LL*g0_L*conj(g1_L)
+        scale = np.expand_dims(jones0, -1) * np.expand_dims(np.conjugate(jones1), -2)
+        vis *= scale.reshape(scale.shape[:-2] + (4,))
+    elif kind == 'full':
+        vis_mat = vis.reshape(vis.shape[:-1] + (2, 2))
+        vis_mat[...] = np.matmul(np.matmul(jones0, vis_mat), np.conjugate(np.swapaxes(jones1, -1, -2)))
+    else:
+        raise ValueError("Unknown Jones kind '%s'" % kind)
+
+
+def diag_to_full(jones):
+    """
+    Expand diagonal Jones terms stored as 2-vectors into full 2x2 matrices.
+
+    Parameters
+    ----------
+    jones : ndarray
+        Diagonal Jones terms of shape (..., 2).
+
+    Returns
+    -------
+    ndarray
+        Jones matrices of shape (..., 2, 2).
+    """
+    full = np.zeros(jones.shape + (2,), dtype=jones.dtype)
+    full[..., 0, 0] = jones[..., 0]
+    full[..., 1, 1] = jones[..., 1]
+    return full
+
+
+JONES_KINDS = ('scalar', 'diag', 'full')
+
+def to_full(jones, kind):
+    """
+    Convert Jones terms of any kind into full 2x2 matrices.
+
+    Parameters
+    ----------
+    jones : ndarray
+        Jones terms of the given kind.
+    kind : str
+        One of 'scalar', 'diag' or 'full'.
+
+    Returns
+    -------
+    ndarray
+        Jones matrices of shape (..., 2, 2).
+    """
+    if kind == 'scalar':
+        return jones[..., np.newaxis, np.newaxis] * np.eye(2)
+    elif kind == 'diag':
+        return diag_to_full(jones)
+    return jones
+
+
+def compose_jones(outer, outer_kind, inner, inner_kind):
+    """
+    Multiply two Jones terms, i.e. outer.inner, keeping the simplest representation
+    that can hold the product.
+
+    Parameters
+    ----------
+    outer, inner : ndarray
+        Jones terms. The inner term is the one applied to the visibilities first.
+    outer_kind, inner_kind : str
+        Kinds of the two Jones terms; one of 'scalar', 'diag' or 'full'.
+
+    Returns
+    -------
+    product : ndarray
+        The product of the two Jones terms.
+    kind : str
+        The kind of the product.
+    """
+    kind = JONES_KINDS[max(JONES_KINDS.index(outer_kind), JONES_KINDS.index(inner_kind))]
+    if kind == 'full':
+        return np.matmul(to_full(outer, outer_kind), to_full(inner, inner_kind)), kind
+    if kind == 'diag':
+        # a scalar term scales both diagonal elements
+        if outer_kind == 'scalar':
+            outer = np.expand_dims(outer, -1)
+        if inner_kind == 'scalar':
+            inner = np.expand_dims(inner, -1)
+    return outer * inner, kind
@@ -0,0 +1,220 @@
+# coding: utf-8
+import mmap
+import multiprocessing
+import numpy as np
+
+# INI: stream identifiers, so that noise terms drawn with the same seed are independent
+THERMAL_NOISE_STREAM = 0
+SKY_NOISE_STREAM = 1
+
+def noise_key(seed, stream, realisation=0):
+    """
+    Derive the key of a counter-based (Philox) noise generator from a user seed, a stream identifier and a realisation.
+
+    Parameters
+    ----------
+    seed : int
+        User-specified seed (e.g. predict_seed or atm_seed).
+    stream : int
+        Identifier of the noise term, e.g. THERMAL_NOISE_STREAM or SKY_NOISE_STREAM.
+    realisation : int
+        Index of an independent realisation of the noise term, e.g. for an ensemble of simulations of the same
+        observation. Realisation 0 is the noise of the output column.
+
+    Returns
+    -------
+    ndarray
+        Philox key (two 64-bit words).
+    """
+    entropy = [seed, stream] if realisation == 0 else [seed, stream, realisation]
+    return np.random.SeedSequence(entropy).generate_state(2, np.uint64)
+
+
+def baseline_index(ant1, ant2, nant):
+    """
+    Index of every baseline (ant1 < ant2) in the list of all nant*(nant-1)/2 baselines ordered by (ant1, ant2).
+
+    Parameters
+    ----------
+    ant1, ant2 : ndarray
+        ANTENNA1 and ANTENNA2 of every row.
+    nant : int
+        Number of antennas.
+
+    Returns
+    -------
+    ndarray
+        Baseline index of every row. Rows that are not cross-correlations with ant1 < ant2 are mapped to 0.
+    """
+    index = ant1 * nant - ant1 * (ant1 + 1) // 2 + ant2 - ant1 - 1
+    return np.where(ant2 > ant1, index, 0)
+
+
+def standard_complex_noise(key, time_index, nbl, shape):
+    """
+    Draw complex Gaussian noise with unit standard deviation in the real and imaginary parts for all baselines
+    of a single timestamp. The Philox counter is set by the timestamp, so the draws of any timestamp can be
+    regenerated independently of all others.
+
+    Parameters
+    ----------
+    key : ndarray
+        Philox key returned by noise_key.
+    time_index : int
+        Index of the timestamp in the array of unique timestamps.
+    nbl : int
+        Number of baselines.
+    shape : tuple
+        Shape of the noise per baseline, e.g. (nchan, 4).
+
+    Returns
+    -------
+    ndarray
+        Complex noise of shape (nbl,) + shape.
+    """
+    generator = np.random.Generator(np.random.Philox(key=key, counter=[0, 0, time_index, 0]))
+    draws = generator.standard_normal((2, nbl) + tuple(shape))
+    return draws[0] + 1j * draws[1]
+
+
+def standard_noise(key, time_index, bl_index, nbl, shape, out=None):
+    """
+    Draw complex Gaussian noise with unit standard deviation in the real and imaginary parts for a block of rows.
+    The noise of every row depends only on the key, its timestamp and its baseline, i.e. not on the block of rows
+    it is drawn in. Note that all nbl baselines are drawn for every timestamp present in the block, however few of
+    its rows are, so that a timestamp split across blocks (or with flagged rows) costs more than its share.
+
+    Parameters
+    ----------
+    key : ndarray
+        Philox key returned by noise_key.
+    time_index : ndarray
+        Index into the unique timestamps for every row.
+    bl_index : ndarray
+        Baseline index (see baseline_index) for every row.
+    nbl : int
+        Number of baselines.
+    shape : tuple
+        Shape of the noise per row, e.g. (nchan, 4).
+    out : ndarray
+        Complex output array of shape (nrow,) + shape. If None, a new array is allocated.
+
+    Returns
+    -------
+    ndarray
+        Complex noise of shape (nrow,) + shape.
+    """
+    if out is None:
+        out = np.empty((time_index.shape[0],) + tuple(shape), dtype=complex)
+    order = np.argsort(time_index, kind='stable')
+    times, starts = np.unique(time_index[order], return_index=True)
+    ends = np.append(starts[1:], order.shape[0])
+    for tind, start, end in zip(times, starts, ends):
+        rows = order[start:end]
+        out[rows] = standard_complex_noise(key, int(tind), nbl, shape)[bl_index[rows]]
+    return out
+
+
+def realise_noise(key, rms, time_index, bl_index, nbl):
+    """
+    Realise complex Gaussian noise for a block of rows (see standard_noise).
+
+    Parameters
+    ----------
+    key : ndarray
+        Philox key returned by noise_key.
+    rms : ndarray
+        Noise rms of shape (nrow, nchan, 4).
+    time_index : ndarray
+        Index into the unique timestamps for every row.
+    bl_index : ndarray
+        Baseline index (see baseline_index) for every row.
+    nbl : int
+        Number of baselines.
+
+    Returns
+    -------
+    ndarray
+        Complex noise of shape (nrow, nchan, 4).
+    """
+    noise = standard_noise(key, time_index, bl_index, nbl, rms.shape[1:])
+    noise *= rms
+    return noise
+
+
+# INI: shared-memory output buffer of a noise worker, handed over by the pool initializer when the worker is forked
+_worker_buffer = None
+
+def _init_noise_worker(buffer):
+    global _worker_buffer
+    _worker_buffer = buffer
+
+
+def _realise_noise_block(task):
+    """
+    Draw the unit noise of a block of rows in a worker process into its slot of the shared output buffer.
+    """
+    key, time_index, bl_index, nbl, start, stop = task
+    standard_noise(key, time_index, bl_index, nbl, _worker_buffer.shape[1:], out=_worker_buffer[start:stop])
+
+
+class NoisePool:
+    """
+    Pool of worker processes that realise noise like realise_noise, drawing disjoint blocks of rows concurrently.
+
+    The pool is forked once and reused for every call to realise. The workers write into a shared-memory buffer
+    of maxrows rows that is allocated before the fork; every task only carries the key, the timestamp and baseline
+    indices of its rows and its slot in the buffer. Passes and blocks are split on timestamp boundaries, so that every
+    timestamp is drawn once (see standard_noise) unless it alone has more than maxrows rows. Since the noise is drawn
+    from counter-based generators, the result is identical to that of realise_noise for any number of workers.
+
+    Parameters
+    ----------
+    nworkers : int
+        Number of worker processes.
+    maxrows : int
+        Number of rows drawn concurrently, e.g. the chunk size. Larger blocks of rows are drawn in several passes.
+    shape : tuple
+        Shape of the noise per row, e.g. (nchan, 4).
+    """
+    def __init__(self, nworkers, maxrows, shape):
+        self.nworkers = nworkers
+        size = max(1, maxrows) * int(np.prod(shape))
+        self.buffer = np.frombuffer(mmap.mmap(-1, size * np.dtype(complex).itemsize), dtype=complex, count=size).reshape((max(1, maxrows),) + tuple(shape))
+        self.pool = multiprocessing.get_context('fork').Pool(nworkers, initializer=_init_noise_worker, initargs=(self.buffer,))
+
+    def realise(self, key, rms, time_index, bl_index, nbl):
+        """
+        Realise complex Gaussian noise for a block of rows. See realise_noise for the parameters.
+        """
+        noise = np.empty(rms.shape, dtype=complex)
+        maxrows, nrow = self.buffer.shape[0], rms.shape[0]
+        # INI: rows are drawn in time order; bounds are the positions at which a new timestamp starts
+        order = np.argsort(time_index, kind='stable')
+        bounds = np.concatenate(([0], np.flatnonzero(np.diff(time_index[order])) + 1, [nrow]))
+        start = 0
+        while start < nrow:
+            stop = min(start + maxrows, nrow)
+            if stop < nrow:
+                # INI: end the pass at the last timestamp boundary that fits, unless a single timestamp fills it
+                boundary = bounds[np.searchsorted(bounds, stop, side='right') - 1]
+                stop = boundary if boundary > start else stop
+            # INI: split the rows of this pass into at most one block per worker, cutting at the next timestamp boundary
+            blocksize = int(np.ceil((stop - start) / float(self.nworkers)))
+            cuts = np.minimum(bounds[np.minimum(np.searchsorted(bounds, start + blocksize * np.arange(1, self.nworkers)),
+                                                bounds.shape[0] - 1)], stop)
+            cuts = np.unique(np.concatenate(([start], cuts, [stop])))
+            tasks = [(key, time_index[order[begin:end]], bl_index[order[begin:end]], nbl, begin-start, end-start)
+                     for begin, end in zip(cuts[:-1], cuts[1:])]
+            self.pool.map(_realise_noise_block, tasks)
+            noise[order[start:stop]] = self.buffer[:stop-start]
+            start = stop
+        noise *= rms
+        return noise
+
+    def close(self):
+        """
+        Terminate the worker processes.
+        """
+        self.pool.close()
+        self.pool.join()
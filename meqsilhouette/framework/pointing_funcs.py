@@ -0,0 +1,64 @@
+# coding: utf-8
+import numpy as np
+from scipy.signal import lfilter
+
+def gaussian_beam_gain(offset, fwhm):
+    """
+    Voltage gain of a Gaussian primary beam at a pointing offset.
+
+    Parameters
+    ----------
+    offset : ndarray
+        Pointing offsets in arcsec.
+    fwhm : ndarray
+        Full width at half maximum of the primary beam in arcsec, broadcastable with offset.
+
+    Returns
+    -------
+    ndarray
+        Primary beam gain.
+    """
+    return np.exp(-0.5*(offset/(fwhm/2.35))**2)
+
+
+def ou_process(time_in_secs, timescale, rms, rng, nseries=1):
+    """
+    Sample stationary Ornstein-Uhlenbeck processes (Gaussian with exponential autocorrelation) at sorted timestamps.
+
+    Consecutive samples follow the exact AR(1) transition for their time separation, so that any sampling (including
+    gaps) is handled exactly. Runs of equally spaced samples are filtered with a single call to lfilter, so the cost
+    is a few vectorised passes over the samples.
+
+    Parameters
+    ----------
+    time_in_secs : ndarray
+        Sorted timestamps in seconds.
+    timescale : float
+        Correlation time in seconds.
+    rms : float
+        Standard deviation of the process.
+    rng : numpy.random.Generator
+        Random number generator.
+    nseries : int
+        Number of independent processes, e.g. one per antenna.
+
+    Returns
+    -------
+    ndarray
+        Samples of shape (nseries, len(time_in_secs)).
+    """
+    nsamples = time_in_secs.shape[0]
+    series = np.zeros((nseries, nsamples))
+    if rms == 0 or nsamples == 0:
+        return series
+    series[:, 0] = rms * rng.standard_normal(nseries)
+    rho = np.exp(-np.diff(time_in_secs) / timescale) # correlation between consecutive samples
+    innovations = rms * np.sqrt(1 - rho**2) * rng.standard_normal((nseries, nsamples-1))
+
+    # INI: split the steps into runs of constant correlation, each of which is a linear filter with constant coefficients
+    edges = np.concatenate(([0], np.flatnonzero(~np.isclose(np.diff(rho), 0, rtol=0, atol=1e-12)) + 1, [nsamples-1]))
+    for start, stop in zip(edges[:-1], edges[1:]):
+        if stop > start:
+            series[:, start+1:stop+1] = lfilter([1.], [1., -rho[start]], innovations[:, start:stop], axis=1,
+                                                zi=rho[start]*series[:, start:start+1])[0]
+    return series
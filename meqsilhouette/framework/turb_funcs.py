@@ -0,0 +1,417 @@
+# coding: utf-8
+import numpy as np
+
+def structure_function(tau, coherence_time, beta=5/3.):
+    """
+    Power-law structure function of the turbulent phase, D(tau) = (tau/coherence_time)**beta.
+
+    Parameters
+    ----------
+    tau : ndarray
+        Time lags in seconds.
+    coherence_time : float
+        Coherence time in seconds, i.e. the lag at which the rms phase difference is 1 radian.
+    beta : float
+        Power-law index (5/3 for Kolmogorov turbulence).
+
+    Returns
+    -------
+    ndarray
+        Structure function in rad**2.
+    """
+    return np.power(np.abs(tau) / coherence_time, beta)
+
+
+def increment_spectrum(nsamples, dt, coherence_time, beta=5/3.):
+    """
+    Eigenvalues of the circulant embedding of the covariance of the phase increments between consecutive
+    samples of a uniform time grid, for a phase with structure function D(tau) (i.e. fractional Brownian
+    motion with Hurst index beta/2).
+
+    Parameters
+    ----------
+    nsamples : int
+        Number of samples of the uniform time grid.
+    dt : float
+        Sampling interval in seconds.
+    coherence_time : float
+        Coherence time in seconds (see structure_function).
+    beta : float
+        Power-law index.
+
+    Returns
+    -------
+    ndarray
+        Non-negative eigenvalues of the circulant embedding.
+    """
+    nincr = max(nsamples - 1, 1)
+    lags = np.arange(nincr, dtype=float)
+    # INI: autocovariance of the increments (fractional Gaussian noise) at lags of 0..nincr-1 samples
+    autocov = 0.5 * (structure_function((lags+1)*dt, coherence_time, beta) - 2*structure_function(lags*dt, coherence_time, beta) +
+                     structure_function((lags-1)*dt, coherence_time, beta))
+    embedding = np.concatenate((autocov, autocov[-2:0:-1]))
+    # INI: the embedding is non-negative definite for beta <= 2; clip negative round-off errors
+    return np.maximum(np.fft.fft(embedding).real, 0.)
+
+
+def fbm_fft(nsamples, dt, coherence_time, rng, beta=5/3., spectrum=None, nreal=None):
+    """
+    Generate a phase time series with structure function D(tau) that starts at zero (i.e. fractional Brownian
+    motion with Hurst index beta/2) on a uniform time grid in O(N log N) time and O(N) memory, by circulant
+    embedding of the covariance of its increments.
+
+    Parameters
+    ----------
+    nsamples : int
+        Number of samples of the uniform time grid.
+    dt : float
+        Sampling interval in seconds.
+    coherence_time : float
+        Coherence time in seconds (see structure_function).
+    rng : numpy.random.Generator
+        Random number generator.
+    beta : float
+        Power-law index.
+    spectrum : ndarray
+        Precomputed increment_spectrum(nsamples, dt, coherence_time, beta), if available.
+    nreal : int
+        Number of independent realisations, drawn in one batch. If None, a single realisation is drawn.
+
+    Returns
+    -------
+    ndarray
+        Phase in radians of shape (nsamples,), or (nsamples, nreal) if nreal is given.
+    """
+    if spectrum is None:
+        spectrum = increment_spectrum(nsamples, dt, coherence_time, beta)
+    nembed = spectrum.shape[0]
+    shape = () if nreal is None else (nreal,)
+    noise = rng.standard_normal((2, nembed) + shape)
+    scale = np.sqrt(spectrum / nembed).reshape((nembed,) + (1,)*len(shape))
+    increments = np.fft.fft(scale * (noise[0] + 1j*noise[1]), axis=0).real[:nsamples-1]
+
+    phase = np.zeros((nsamples,) + shape)
+    phase[1:] = np.cumsum(increments, axis=0)
+    return phase
+
+
+def turbulent_phase_fft(nsamples, dt, coherence_time, rng, beta=5/3., spectrum=None, nreal=None):
+    """
+    Generate a turbulent phase time series with structure function D(tau) on a uniform time grid in O(N log N)
+    time and O(N) memory (see fbm_fft).
+
+    The phase starts at a random offset with variance D(T)/2, where T is the length of the time grid, as for the
+    stationary covariance 0.5*(D(T) - D(tau)) clipped at the largest mode used by turbulent_phase_cholesky.
+
+    Parameters
+    ----------
+    nsamples : int
+        Number of samples of the uniform time grid.
+    dt : float
+        Sampling interval in seconds.
+    coherence_time : float
+        Coherence time in seconds (see structure_function).
+    rng : numpy.random.Generator
+        Random number generator.
+    beta : float
+        Power-law index.
+    spectrum : ndarray
+        Precomputed increment_spectrum(nsamples, dt, coherence_time, beta), if available.
+    nreal : int
+        Number of independent realisations, drawn in one batch. If None, a single realisation is drawn.
+
+    Returns
+    -------
+    ndarray
+        Turbulent phase in radians of shape (nsamples,), or (nsamples, nreal) if nreal is given.
+    """
+    phase = fbm_fft(nsamples, dt, coherence_time, rng, beta, spectrum, nreal)
+    shape = () if nreal is None else (nreal,)
+    phase += np.sqrt(0.5 * structure_function((nsamples-1)*dt, coherence_time, beta)) * rng.standard_normal(shape)
+    return phase
+
+
+def split_scans(time_in_secs, dt, gap_factor=1.5):
+    """
+    Split sorted timestamps into scans, i.e. runs of timestamps separated by at most gap_factor*dt.
+
+    Parameters
+    ----------
+    time_in_secs : ndarray
+        Sorted timestamps in seconds.
+    dt : float
+        Sampling interval in seconds.
+    gap_factor : float
+        Separations larger than gap_factor*dt are treated as gaps between scans.
+
+    Returns
+    -------
+    list of ndarray
+        Indices of the timestamps of every scan.
+    """
+    breaks = np.flatnonzero(np.diff(time_in_secs) > gap_factor*dt) + 1
+    return np.split(np.arange(time_in_secs.shape[0]), breaks)
+
+
+def fbm_covariance(ta, tb, coherence_time, beta=5/3.):
+    """
+    Covariance 0.5*(D(ta) + D(tb) - D(ta-tb)) of a phase with structure function D(tau) that is zero at time 0.
+    """
+    return 0.5 * (structure_function(ta, coherence_time, beta) + structure_function(tb, coherence_time, beta) -
+                  structure_function(ta-tb, coherence_time, beta))
+
+
+def turbulent_phase_scans(time_in_secs, dt, coherence_time, rng, beta=5/3., spectrum_func=None, nreal=None):
+    """
+    Generate a turbulent phase with structure function D(tau) at the actual timestamps of an observation with
+    gaps between scans, at a cost proportional to the number of on-source samples rather than to the length of the
+    observation.
+
+    The phases at the start and end of every scan are drawn jointly from their exact covariance. The phase within
+    every scan is then drawn on a uniform grid with FFTs (see fbm_fft), conditioned on the phase difference between
+    the ends of the scan. The statistics within every scan and between the scan ends are thus exact; between
+    samples inside different scans, only the correlation carried by the scan ends is retained. As in
+    turbulent_phase_fft, the phase starts at a random offset with variance D(T)/2, with T the length of the
+    observation.
+
+    Parameters
+    ----------
+    time_in_secs : ndarray
+        Sorted timestamps in seconds since the first timestamp.
+    dt : float
+        Sampling interval within scans in seconds.
+    coherence_time : float
+        Coherence time in seconds (see structure_function).
+    rng : numpy.random.Generator
+        Random number generator.
+    beta : float
+        Power-law index.
+    spectrum_func : callable
+        Function that returns the increment spectrum of a scan given its number of grid samples, e.g. to reuse
+        cached spectra. Defaults to increment_spectrum.
+    nreal : int
+        Number of independent realisations, drawn in one batch. If None, a single realisation is drawn.
+
+    Returns
+    -------
+    ndarray
+        Turbulent phase in radians of shape time_in_secs.shape, or time_in_secs.shape + (nreal,) if nreal is given.
+    """
+    if spectrum_func is None:
+        spectrum_func = lambda nsamples: increment_spectrum(nsamples, dt, coherence_time, beta)
+    shape = () if nreal is None else (nreal,)
+    scans = split_scans(time_in_secs, dt)
+
+    # INI: draw the phases at the ends of all scans (relative to the phase at the first timestamp) jointly
+    ends = np.unique(np.concatenate([time_in_secs[[scan[0], scan[-1]]] for scan in scans]))
+    ends = ends[ends > 0]
+    end_phase = {0.: np.zeros(shape)}
+    if ends.shape[0] > 0:
+        factor = np.linalg.cholesky(fbm_covariance(ends[:, np.newaxis], ends[np.newaxis, :], coherence_time, beta))
+        draws = factor.dot(rng.standard_normal((ends.shape[0],) + shape))
+        end_phase.update(zip(ends, draws))
+
+    phase = np.zeros(time_in_secs.shape + shape)
+    for scan in scans:
+        start, end = time_in_secs[scan[0]], time_in_secs[scan[-1]]
+        grid_index = np.rint((time_in_secs[scan] - start) / dt).astype(int)
+        nsamples = grid_index[-1] + 1
+        bridge = fbm_fft(nsamples, dt, coherence_time, rng, beta, spectrum_func(nsamples), nreal)
+        lags = np.arange(nsamples) * dt
+        length = lags[-1]
+        if length > 0:
+            # INI: condition the phase within the scan on the phase difference between its ends
+            weight = fbm_covariance(lags, length, coherence_time, beta) / structure_function(length, coherence_time, beta)
+            weight = weight.reshape((nsamples,) + (1,)*len(shape))
+            bridge += weight * (end_phase[end] - end_phase[start] - bridge[-1])
+        phase[scan] = end_phase[start] + bridge[grid_index]
+
+    phase += np.sqrt(0.5 * structure_function(time_in_secs[-1], coherence_time, beta)) * rng.standard_normal(shape)
+    return phase
+
+
+def difference_covariance(points_a, coeffs_a, points_b, coeffs_b, coherence_time, beta=5/3.):
+    """
+    Covariance between two linear combinations of the phase of a 2-D isotropic screen with structure function
+    D(|r|), sum_i a_i phi(p_i) and sum_j b_j phi(q_j), with coefficients that sum to zero. It is equal to
+    -0.5 sum_ij a_i b_j D(|p_i - q_j|) and hence does not depend on the (undefined) mean phase of the screen.
+
+    Parameters
+    ----------
+    points_a, points_b : ndarray
+        Screen positions of shape (..., npoints, 2), in seconds (i.e. positions divided by the wind speed).
+    coeffs_a, coeffs_b : ndarray
+        Coefficients of shape (npoints,).
+    coherence_time : float
+        Coherence time in seconds (see structure_function).
+    beta : float
+        Power-law index.
+
+    Returns
+    -------
+    ndarray
+        Covariance of shape points_a.shape[:-2] (broadcast with points_b.shape[:-2]).
+    """
+    separation = points_a[..., :, np.newaxis, :] - points_b[..., np.newaxis, :, :]
+    structD = structure_function(np.hypot(separation[..., 0], separation[..., 1]), coherence_time, beta)
+    return -0.5 * np.einsum('...ij,i,j->...', structD, coeffs_a, coeffs_b)
+
+
+def frozen_flow_factor(nsamples, dt, coherence_time, offsets, beta=5/3.):
+    """
+    Spectral factors for generating the phases seen by a cluster of co-located stations that look through the
+    same 2-D Kolmogorov phase screen, blown across the cluster by the wind (frozen flow). In units of time, the
+    screen has the structure function D(|r|) with r the separation divided by the wind speed, which corresponds
+    to a Fried parameter r0 = wind speed * coherence_time and gives every station the temporal structure function
+    D(tau).
+
+    Every station samples the screen along a track parallel to the wind. The phase increments along the track of
+    the first station and the phase differences between every other station and the first one are jointly
+    stationary with finite variance, and their cross-covariances follow from D (see difference_covariance). They
+    are generated exactly by multivariate circulant embedding in O(N log N) time, without discretising the screen.
+
+    Parameters
+    ----------
+    nsamples : int
+        Number of samples of the uniform time grid.
+    dt : float
+        Sampling interval in seconds.
+    coherence_time : float
+        Coherence time in seconds (see structure_function).
+    offsets : ndarray
+        Station positions of shape (nstation, 2) in the frame of the screen, relative to the first station and divided
+        by the wind speed: station k samples the screen at (offsets[k, 0] + t, offsets[k, 1]) at time t. The first
+        column is thus the along-wind screen coordinate (s), i.e. minus the delay with which the station sees the
+        screen after the first one (a station downwind by d has offsets[k, 0] = -d / wind speed), and the second the
+        cross-wind separation (s).
+    beta : float
+        Power-law index.
+
+    Returns
+    -------
+    ndarray
+        Factors of the spectral density matrices of shape (nembed, nstation, nstation).
+    """
+    nstation = offsets.shape[0]
+    nlags = max(nsamples, 2)
+    lags = np.concatenate((np.arange(nlags), np.arange(-(nlags-2), 0))) * dt
+    shift = np.stack((lags, np.zeros_like(lags)), axis=-1)[:, np.newaxis, :]
+
+    # INI: variable 0 is the phase increment along the track of the first station, variable k the phase of station k minus that of the first one
+    origin = np.asarray(offsets[0], dtype=float)
+    points = [np.array([origin + [dt, 0.], origin])] + [np.array([offsets[k], origin]) for k in range(1, nstation)]
+    coeffs = np.array([1., -1.])
+    embedding = np.zeros((lags.shape[0], nstation, nstation))
+    for k in range(nstation):
+        for l in range(nstation):
+            embedding[:, k, l] = difference_covariance(points[k] + shift, coeffs, points[l], coeffs, coherence_time, beta)
+
+    spectrum = np.fft.fft(embedding, axis=0)
+    spectrum = 0.5 * (spectrum + np.conj(np.swapaxes(spectrum, 1, 2))) # INI: enforce Hermitian symmetry against round-off errors
+    eigval, eigvec = np.linalg.eigh(spectrum)
+    # INI: clip the (small) negative eigenvalues of the embedding
+    return eigvec * np.sqrt(np.maximum(eigval, 0.))[:, np.newaxis, :]
+
+
+def frozen_flow_phases(nsamples, dt, coherence_time, offsets, rng, beta=5/3., factor=None, nreal=None):
+    """
+    Generate the turbulent phases of a cluster of co-located stations looking through a common frozen-flow phase
+    screen (see frozen_flow_factor) on a uniform time grid.
+
+    As in turbulent_phase_fft, the phase of the first station starts at a random offset with variance D(T)/2,
+    where T is the length of the time grid.
+
+    Parameters
+    ----------
+    nsamples : int
+        Number of samples of the uniform time grid.
+    dt : float
+        Sampling interval in seconds.
+    coherence_time : float
+        Coherence time in seconds (see structure_function).
+    offsets : ndarray
+        Station positions in the wind frame (see frozen_flow_factor).
+    rng : numpy.random.Generator
+        Random number generator.
+    beta : float
+        Power-law index.
+    factor : ndarray
+        Precomputed frozen_flow_factor(nsamples, dt, coherence_time, offsets, beta), if available.
+    nreal : int
+        Number of independent realisations, drawn in one batch. If None, a single realisation is drawn.
+
+    Returns
+    -------
+    ndarray
+        Turbulent phases in radians of shape (nsamples, nstation), or (nsamples, nstation, nreal) if nreal is given.
+    """
+    if factor is None:
+        factor = frozen_flow_factor(nsamples, dt, coherence_time, offsets, beta)
+    nembed, nstation = factor.shape[:2]
+    shape = () if nreal is None else (nreal,)
+    noise = rng.standard_normal((2, nembed, nstation) + shape)
+    variables = np.einsum('fkl,fl...->fk...', factor, noise[0] + 1j*noise[1])
+    variables = np.sqrt(nembed) * np.fft.ifft(variables, axis=0).real[:nsamples]
+
+    phase = np.zeros((nsamples,) + shape)
+    phase[1:] = np.cumsum(variables[:nsamples-1, 0], axis=0)
+    phase += np.sqrt(0.5 * structure_function((nsamples-1)*dt, coherence_time, beta)) * rng.standard_normal(shape)
+    phases = np.repeat(phase[:, np.newaxis], nstation, axis=1)
+    phases[:, 1:] += variables[:, 1:]
+    return phases
+
+
+def cholesky_factor(time_in_secs, coherence_time, beta=5/3.):
+    """
+    Dense Cholesky factor of the stationary covariance 0.5*(D(T) - D(tau)) of the turbulent phase, clipped at the
+    largest mode. Needs O(N**2) memory and O(N**3) time.
+
+    Parameters
+    ----------
+    time_in_secs : ndarray
+        Times in seconds since the first sample.
+    coherence_time : float
+        Coherence time in seconds (see structure_function).
+    beta : float
+        Power-law index.
+
+    Returns
+    -------
+    ndarray
+        Lower-triangular Cholesky factor of shape (N, N).
+    """
+    # INI: the covariance is evaluated at the actual time lags, so that gaps between scans are accounted for
+    largest_mode = structure_function(time_in_secs[-1], coherence_time, beta)
+    covmatS = np.abs(0.5*(largest_mode - structure_function(time_in_secs[:, np.newaxis] - time_in_secs[np.newaxis, :], coherence_time, beta)))
+    return np.linalg.cholesky(covmatS) # Cholesky factorise the covariance matrix
+
+
+def turbulent_phase_cholesky(time_in_secs, coherence_time, rng, beta=5/3., factor=None, nreal=None):
+    """
+    Generate a turbulent phase time series from the dense Cholesky factor of its covariance (see cholesky_factor).
+
+    Parameters
+    ----------
+    time_in_secs : ndarray
+        Times in seconds since the first sample.
+    coherence_time : float
+        Coherence time in seconds (see structure_function).
+    rng : numpy.random.Generator
+        Random number generator.
+    beta : float
+        Power-law index.
+    factor : ndarray
+        Precomputed cholesky_factor(time_in_secs, coherence_time, beta), if available.
+    nreal : int
+        Number of independent realisations, drawn in one batch (a single matrix product). If None, a single
+        realisation is drawn.
+
+    Returns
+    -------
+    ndarray
+        Turbulent phase in radians of shape time_in_secs.shape, or time_in_secs.shape + (nreal,) if nreal is given.
+    """
+    if factor is None:
+        factor = cholesky_factor(time_in_secs, coherence_time, beta)
+    shape = () if nreal is None else (nreal,)
+    return factor.dot(rng.standard_normal((time_in_secs.shape[0],) + shape))
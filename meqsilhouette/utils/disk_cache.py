@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+
+# Content-addressed on-disk cache of numpy arrays, shared between runs on the same array and schedule.
+
+import os
+import shutil
+import hashlib
+import tempfile
+import numpy as np
+
+def array_digest(*arrays):
+    """
+    Compute a content hash of a sequence of arrays.
+
+    Parameters
+    ----------
+    arrays : array_like
+        Arrays that determine the cached products. Their dtypes and shapes are hashed along with their contents.
+
+    Returns
+    -------
+    digest : str
+        Hexadecimal SHA-256 digest.
+    """
+    sha = hashlib.sha256()
+    for arr in arrays:
+        arr = np.ascontiguousarray(arr)
+        sha.update(('%s%s'%(arr.dtype.str, arr.shape)).encode())
+        sha.update(arr.tobytes())
+    return sha.hexdigest()
+
+
+def load_cached(cache_dir, key, names):
+    """
+    Load cached arrays as read-only memory maps. The entry is marked as recently used (see evict_lru).
+
+    Parameters
+    ----------
+    cache_dir : str
+        Cache directory.
+    key : str
+        Cache key, e.g. returned by array_digest.
+    names : list of str
+        Names of the arrays to load.
+
+    Returns
+    -------
+    products : dict or None
+        Memory-mapped arrays by name, or None if any of them is not in the cache.
+    """
+    entry = os.path.join(cache_dir, key)
+    paths = dict((name, os.path.join(entry, name+'.npy')) for name in names)
+    if not all(os.path.exists(path) for path in paths.values()):
+        return None
+    os.utime(entry)
+    return dict((name, np.load(path, mmap_mode='r')) for name, path in paths.items())
+
+
+def save_cached(cache_dir, key, products):
+    """
+    Save arrays to the cache. The arrays are written to a temporary directory that is renamed into
+    place, so that concurrent runs never see a partially written cache entry.
+
+    Parameters
+    ----------
+    cache_dir : str
+        Cache directory. Created if it does not exist.
+    key : str
+        Cache key, e.g. returned by array_digest.
+    products : dict
+        Arrays to be saved by name.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    entry = os.path.join(cache_dir, key)
+    if os.path.exists(entry):
+        return
+    tmpdir = tempfile.mkdtemp(dir=cache_dir, prefix='.'+key)
+    for name, arr in products.items():
+        np.save(os.path.join(tmpdir, name+'.npy'), arr)
+    try:
+        os.rename(tmpdir, entry)
+    except OSError: # another run has saved the same entry in the meantime
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+
+def evict_lru(cache_dir, max_bytes, keep=()):
+    """
+    Remove the least recently used cache entries until the total size of the cache is at most max_bytes.
+
+    Parameters
+    ----------
+    cache_dir : str
+        Cache directory.
+    max_bytes : int
+        Maximum total size of the cache in bytes.
+    keep : collection of str
+        Keys of entries that are never removed, e.g. the entries just saved by the caller. They count towards the
+        size of the cache.
+    """
+    if not os.path.isdir(cache_dir):
+        return
+    entries = []
+    for key in os.listdir(cache_dir):
+        entry = os.path.join(cache_dir, key)
+        if key.startswith('.') or not os.path.isdir(entry): # skip entries that are being written
+            continue
+        size = sum(os.path.getsize(os.path.join(entry, name)) for name in os.listdir(entry))
+        entries.append((os.path.getmtime(entry), size, key))
+
+    total = sum(size for mtime, size, key in entries)
+    for mtime, size, key in sorted(entries):
+        if total <= max_bytes:
+            break
+        if key in keep:
+            continue
+        shutil.rmtree(os.path.join(cache_dir, key), ignore_errors=True)
+        total -= size
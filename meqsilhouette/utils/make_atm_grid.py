@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+
+""" builds a lookup table (atmosphere grid) of AATM opacities, emissivity and path lengths
+Usage: python make_atm_grid.py <output.npz> --pwv 0.5 4 8 --gpress 550 650 5 --gtemp 260 290 4 --fmin 226 --fmax 230 --fstep 0.1
+
+Each of --pwv, --gpress and --gtemp takes the first node, the last node and the number of nodes of the grid.
+The output file can be passed to MeqSilhouette through the atm_grid parameter.
+"""
+
+import argparse
+import numpy as np
+from meqsilhouette.framework.atm_funcs import build_atm_grid, save_atm_grid
+from meqsilhouette.utils.comm_functions import info
+
+
+def make_atm_grid(outfile, pwv, gpress, gtemp, fmin, fmax, fstep, nworkers=0):
+    """
+    Build an atmosphere grid with AATM and save it.
+
+    Parameters
+    ----------
+    outfile : str
+        Output npz file.
+    pwv, gpress, gtemp : tuple
+        (first node, last node, number of nodes) of the precipitable water vapour (mm), ground pressure (mbar)
+        and ground temperature (K) grids.
+    fmin, fmax, fstep : float
+        Frequency grid in GHz, as passed to AATM.
+    nworkers : int
+        Maximum number of concurrent AATM processes (0: one per CPU).
+    """
+    axes = [np.linspace(start, stop, int(num)) for start, stop, num in (pwv, gpress, gtemp)]
+    info('Running AATM on a %d x %d x %d grid of (pwv, gpress, gtemp)...'%tuple(axis.shape[0] for axis in axes))
+    grid = build_atm_grid(axes[0], axes[1], axes[2], fmin, fmax, fstep, nworkers)
+    save_atm_grid(outfile, grid)
+    info('Atmosphere grid with %d frequency channels saved to %s'%(grid['freq'].shape[0], outfile))
+
+
+if __name__ == '__main__':
+    p = argparse.ArgumentParser(description='Build an atmosphere grid for MeqSilhouette using AATM')
+    p.add_argument('outfile', help='output npz file')
+    p.add_argument('--pwv', nargs=3, type=float, required=True, metavar=('FIRST', 'LAST', 'NUM'), help='pwv grid (mm)')
+    p.add_argument('--gpress', nargs=3, type=float, required=True, metavar=('FIRST', 'LAST', 'NUM'), help='ground pressure grid (mbar)')
+    p.add_argument('--gtemp', nargs=3, type=float, required=True, metavar=('FIRST', 'LAST', 'NUM'), help='ground temperature grid (K)')
+    p.add_argument('--fmin', type=float, required=True, help='AATM fmin (GHz)')
+    p.add_argument('--fmax', type=float, required=True, help='AATM fmax (GHz)')
+    p.add_argument('--fstep', type=float, required=True, help='AATM fstep (GHz)')
+    p.add_argument('--workers', type=int, default=0, help='maximum number of concurrent AATM processes (default: one per CPU)')
+    args = p.parse_args()
+
+    make_atm_grid(args.outfile, args.pwv, args.gpress, args.gtemp, args.fmin, args.fmax, args.fstep, args.workers)